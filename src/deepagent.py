@@ -1,14 +1,11 @@
-import httpx
 import os
 from typing import Any
-from jinja2 import Template
+from jinja2 import Environment, FileSystemLoader
 from pathlib import Path
-import aiofiles
 
-from langchain.chat_models import init_chat_model
 from langchain.agents import create_agent
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
-from langgraph.graph import END, START, StateGraph
+from langgraph.graph import END, START
 from langchain.agents.middleware import (
     AgentMiddleware,
     TodoListMiddleware,
@@ -23,6 +20,7 @@ from langchain.agents.middleware import (
 )
 
 
+from .zena_common import get_chat_model, logger, setup_logging
 from .zena_agent_node import (
     verification_message,
     data_collection,
@@ -30,29 +28,30 @@ from .zena_agent_node import (
 
 from dotenv import load_dotenv
 
-from .zena_state import Context, InputState, OutputState, State
+from .zena_state import State, new_workflow
 
 
+# Локальный .env этой точки входа: нужен для OPENAI_MODEL/OPENAI_API_KEY ниже.
+# Настройки, которые zena_common читает при импорте (OPENAI_PROXY_URL и др.),
+# берутся из deploy/dev.env через load_env().
 load_dotenv()
+setup_logging()
 
-openai_proxy = os.getenv("OPENAI_PROXY_URL")
 openai_model = os.getenv("OPENAI_MODEL")
 openai_api_key = os.getenv("OPENAI_API_KEY")
-http_client = httpx.AsyncClient(proxy=openai_proxy, timeout=60.0)
 
+# Шаблоны компилируются один раз и дальше берутся из кеша Environment.
+TPL_DIR = Path(__file__).parent / "template"
+ENV = Environment(loader=FileSystemLoader(TPL_DIR), auto_reload=False, cache_size=400)
 
-model = init_chat_model(
-    model=openai_model,
-    temperature=0,
-    api_key=openai_api_key,
-    http_async_client=http_client,
-)
+
+model = get_chat_model(openai_model, openai_api_key)
 
 class CustomMiddleware(AgentMiddleware):
     state_schema = State
 
     def before_model(self, state: State, runtime) -> dict[str, Any] | None:
-        print("==before_model==")
+        logger.debug("==before_model==")
         # print(state)
         return None
 
@@ -62,12 +61,8 @@ async def personalized_prompt_1(request: ModelRequest, handler) -> ModelResponse
     """Формирование промпта."""
 
     tpl_system_prompt = request.state["data"]["template_prompt_system"]
-    tpl_path = Path(__file__).parent / "template" / tpl_system_prompt
-
-    async with aiofiles.open(tpl_path, encoding="utf-8") as f:
-        source = await f.read()
- 
-    request.system_prompt = Template(source).render(**request.state["data"])
+    tpl = ENV.get_template(tpl_system_prompt)
+    request.system_prompt = tpl.render(**request.state["data"])
 
     return await handler(request)
 
@@ -77,12 +72,8 @@ async def personalized_prompt_2(request: ModelRequest) -> str:
     """Формирование промпта."""
 
     tpl_system_prompt = request.state["data"]["template_prompt_system"]
-    tpl_path = Path(__file__).parent / "template" / tpl_system_prompt
-
-    async with aiofiles.open(tpl_path, encoding="utf-8") as f:
-        source = await f.read()
- 
-    system_prompt = Template(source).render(**request.state["data"])
+    tpl = ENV.get_template(tpl_system_prompt)
+    system_prompt = tpl.render(**request.state["data"])
 
     return system_prompt
 
@@ -106,12 +97,7 @@ agent = create_agent(
     ]
 )
 
-workflow = StateGraph(
-    state_schema=State,
-    input_schema=InputState,
-    output_schema=OutputState,
-    context_schema=Context,
-)
+workflow = new_workflow()
 
 workflow.add_node("verification_message", verification_message)
 workflow.add_node("data_collection", data_collection)
@@ -1,36 +1,59 @@
 """Модуль описывающий ноды графа."""
 
+import asyncio
 import os
 import time
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Literal, Union
 
-import aiofiles
-import httpx
 from jinja2 import Template
-from langchain.chat_models import init_chat_model
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
 from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.runnables import Runnable
+from langchain_core.tools import BaseTool
 from langchain_mcp_adapters.client import MultiServerMCPClient
 from langgraph.prebuilt import ToolNode
 from langgraph.runtime import Runtime
 from langgraph.types import Command
 
-from .zena_common import _content_to_text, _func_name, logger
+from .zena_common import (
+    PREDEFINED_MESSAGES,
+    PREDEFINED_STOP,
+    _content_to_text,
+    _is_keyword,
+    _LazyRepr,
+    get_chat_model,
+    logger,
+)
 from .zena_postgres import data_collection_postgres, delete_history_messages
 from .zena_state import Context, State
 
-PREDEFINED_MESSAGES = [
-    "Ваше сообщение не может быть обработано 🚫",
-    "Пожалуйста, отправьте корректные данные 🙏",
-    "Мы не можем принять это сообщение ❌",
-    "Ай-ай-ай, ругаться плохо!",
-    "Давайте без таких слов 🙂",
-    "Попробуйте выразиться по-другому 😉",
-    "Нехорошо так говорить 😇",
-    "Давайте держать общение в позитивном ключе!",
-]
+TEMPLATE_DIR = Path(__file__).parent / "template"
+# Как часто (сек) сверять mtime файла шаблона: правки подхватываются без рестарта,
+# но stat не делается на каждый запрос.
+TEMPLATE_RECHECK_SEC = 5.0
 
-PREDEFINED_STOP = "стоп"  # По этому кодовому слову чистится история диалога.
+# Имя шаблона -> (скомпилированный Template, mtime файла, время последней проверки).
+_TEMPLATES: dict[str, tuple[Template, float, float]] = {}
+
+
+def _get_template(name: str) -> Template:
+    """Возвращает скомпилированный шаблон, перечитывая файл только при смене mtime."""
+    now = time.monotonic()
+    entry = _TEMPLATES.get(name)
+    if entry is not None and now - entry[2] < TEMPLATE_RECHECK_SEC:
+        return entry[0]
+
+    tpl_path = TEMPLATE_DIR / name
+    mtime = tpl_path.stat().st_mtime
+    if entry is not None and entry[1] == mtime:
+        _TEMPLATES[name] = (entry[0], mtime, now)
+        return entry[0]
+
+    tpl = Template(tpl_path.read_text(encoding="utf-8"))
+    _TEMPLATES[name] = (tpl, mtime, now)
+    return tpl
 
 
 async def verification_message(
@@ -53,7 +76,7 @@ async def verification_message(
         )
         last_message = _content_to_text(last_msg_content).strip()
 
-        if last_message.lower() == PREDEFINED_STOP:
+        if _is_keyword(last_message, PREDEFINED_STOP):
             await delete_history_messages(user_companychat)
             return Command(
                 goto="__end__",
@@ -80,7 +103,7 @@ async def verification_message(
 
     except Exception as err:
         raise RuntimeError(
-            f"{_func_name(0)}: ошибка верификации первого сообщения: {err}"
+            f"verification_message: ошибка верификации первого сообщения: {err}"
         ) from err
 
 
@@ -89,7 +112,7 @@ async def data_collection(state: State) -> State:
     try:
         t0 = time.perf_counter()
         gathered = await data_collection_postgres(state["user_companychat"])
-        duration = round(time.perf_counter() - t0, 4)
+        duration = time.perf_counter() - t0
         return {
             **gathered,
             "query": state["messages"][-1].content,
@@ -98,23 +121,23 @@ async def data_collection(state: State) -> State:
         }
     except Exception as err:
         raise RuntimeError(
-            f"{_func_name(0)}: ошибка загрузки данных из Postgres: {err}"
+            f"data_collection: ошибка загрузки данных из Postgres: {err}"
         ) from err
 
 
 async def builder_prompt(state: State) -> State:
     """Рендеринг системного промпта из шаблона (без блокирующего I/O)."""
+    return await _render_prompt(state)
+
+
+async def _render_prompt(state: State) -> State:
     try:
         t0 = time.perf_counter()
 
         template_prompt_system = state["data"]["template_prompt_system"]
-        tpl_path = Path(__file__).parent / "template" / template_prompt_system
-
-        async with aiofiles.open(tpl_path, encoding="utf-8") as f:
-            source = await f.read()
-        prompt_system = Template(source).render(**state["data"])
+        prompt_system = _get_template(template_prompt_system).render(**state["data"])
 
-        duration = round(time.perf_counter() - t0, 4)
+        duration = time.perf_counter() - t0
         logger.info("✅ Промпт отрендерен: %d символов", len(prompt_system))
         return {
             "prompt_system": prompt_system,
@@ -124,17 +147,40 @@ async def builder_prompt(state: State) -> State:
         }
     except Exception as err:
         raise RuntimeError(
-            f"{_func_name(0)}: ошибка формирования промпта: {err}"
+            f"builder_prompt: ошибка формирования промпта: {err}"
         ) from err
 
 
 async def mcp_tools(state: State) -> State:
     """Инициализация MCP инструментов через SSE с динамическим портом и фильтрацией."""
-    try:
-        t0 = time.perf_counter()
+    return await _load_mcp_tools(state)
+
+
+# Схема инструментов MCP-сервера статична, поэтому список tools кешируется на порт.
+MCP_TOOLS_TTL_SEC = 300.0
+
+
+@dataclass
+class _PortTools:
+    fetched_at: float  # time.monotonic()
+    tools: list[BaseTool]
+    # dialog_state -> отфильтрованные инструменты (живут вместе со списком tools)
+    by_state: dict[str, list[BaseTool]] = field(default_factory=dict)
+    # Имена набора tools -> модель с bind_tools и ToolNode. Хранятся на записи порта,
+    # чтобы после обновления по TTL не использовать старые объекты инструментов.
+    bound_models: dict[tuple[str, ...], Runnable[LanguageModelInput, BaseMessage]] = field(
+        default_factory=dict
+    )
+    tool_nodes: dict[tuple[str, ...], ToolNode] = field(default_factory=dict)
 
-        mcp_port = state["data"].get("mcp_port")
 
+_MCP_CLIENTS: dict[int, MultiServerMCPClient] = {}
+_PORT_TOOLS: dict[int, _PortTools] = {}
+
+
+def _get_mcp_client(mcp_port: int) -> MultiServerMCPClient:
+    client = _MCP_CLIENTS.get(mcp_port)
+    if client is None:
         client = MultiServerMCPClient(
             {
                 "company": {
@@ -143,32 +189,57 @@ async def mcp_tools(state: State) -> State:
                 }
             }
         )
-        all_tools = await client.get_tools()
-
-        # Базовые инструменты (доступны всегда)
-        allowed_tool_names = [
-            "zena_faq",
-            "zena_services",
-            "zena_product_search",
-        ]
+        _MCP_CLIENTS[mcp_port] = client
+    return client
+
+
+async def _get_port_tools(mcp_port: int) -> _PortTools:
+    """Возвращает инструменты порта, обращаясь к MCP-серверу не чаще раза в TTL."""
+    now = time.monotonic()
+    entry = _PORT_TOOLS.get(mcp_port)
+    if entry is None or now - entry.fetched_at >= MCP_TOOLS_TTL_SEC:
+        tools = await _get_mcp_client(mcp_port).get_tools()
+        entry = _PortTools(fetched_at=now, tools=tools)
+        _PORT_TOOLS[mcp_port] = entry
+    return entry
+
+
+# Разрешённые инструменты по dialog_state (считаются один раз при импорте).
+# Базовые инструменты доступны всегда; неизвестная стадия получает полный набор.
+_BASE_TOOLS = frozenset({"zena_faq", "zena_services", "zena_product_search"})
+_SELECTING_TOOLS = _BASE_TOOLS | {"zena_record_product_id"}
+_ALL_TOOLS = _SELECTING_TOOLS | {"zena_record_time", "zena_available_time_for_master"}
+_STATE_TOOLS: dict[str, frozenset[str]] = {
+    "new": _BASE_TOOLS,
+    "selecting": _SELECTING_TOOLS,
+    "record": _ALL_TOOLS,
+    "posrecord": _ALL_TOOLS,
+}
+
+
+async def _load_mcp_tools(state: State) -> State:
+    try:
+        t0 = time.perf_counter()
 
+        mcp_port = state["data"].get("mcp_port")
         dialog_state = state["data"].get("dialog_state", "new")
 
-        if dialog_state not in ["new"]:
-            allowed_tool_names.append("zena_record_product_id")
+        entry = await _get_port_tools(mcp_port)
+        all_tools = entry.tools
+        filtered_tools = entry.by_state.get(dialog_state)
+        if filtered_tools is None:
+            allowed_tool_names = _STATE_TOOLS.get(dialog_state, _ALL_TOOLS)
+            filtered_tools = [tool for tool in all_tools if tool.name in allowed_tool_names]
+            entry.by_state[dialog_state] = filtered_tools
 
-        if dialog_state not in ["new", "selecting"]:
-            allowed_tool_names.extend(
-                ["zena_record_time", "zena_available_time_for_master"]
-            )
-        # Фильтруем инструменты
-        filtered_tools = [tool for tool in all_tools if tool.name in allowed_tool_names]
-
-        logger.info(f"✅ Порт {mcp_port}, dialog_state='{dialog_state}'")
+        logger.info("✅ Порт %s, dialog_state='%s'", mcp_port, dialog_state)
         logger.info(
-            f"✅ Доступно {len(filtered_tools)} из {len(all_tools)} инструментов: {[t.name for t in filtered_tools]}"
+            "✅ Доступно %d из %d инструментов: %s",
+            len(filtered_tools),
+            len(all_tools),
+            _LazyRepr(lambda: [t.name for t in filtered_tools]),
         )
-        duration = round(time.perf_counter() - t0, 4)
+        duration = time.perf_counter() - t0
         return {
             "tools": filtered_tools,
             "time_all": duration,
@@ -177,8 +248,70 @@ async def mcp_tools(state: State) -> State:
         }
     except Exception as err:
         raise RuntimeError(
-            f"{_func_name(0)}: ошибка формирования списка инструментов: {err}"
+            f"mcp_tools: ошибка формирования списка инструментов: {err}"
+        ) from err
+
+
+async def prepare_agent_context(state: State) -> State:
+    """Рендеринг промпта и загрузка MCP инструментов параллельно.
+
+    Обе задачи зависят только от результата data_collection, поэтому
+    задержка узла — максимум из двух, а не их сумма. При ошибке одной
+    задачи TaskGroup отменяет вторую, а не оставляет её работать впустую.
+    """
+    t0 = time.perf_counter()
+    try:
+        async with asyncio.TaskGroup() as tg:
+            prompt_task = tg.create_task(_render_prompt(state))
+            tools_task = tg.create_task(_load_mcp_tools(state))
+    except* Exception as group:
+        err = group.exceptions[0]
+        raise RuntimeError(
+            f"prepare_agent_context: ошибка подготовки контекста агента: {err}"
         ) from err
+    prompt_part, tools_part = prompt_task.result(), tools_task.result()
+    duration = time.perf_counter() - t0
+    return {
+        **prompt_part,
+        **tools_part,
+        "time_all": duration,
+        "time_node": prompt_part["time_node"] + tools_part["time_node"],
+    }
+
+
+# Переменные окружения модели агента читаются один раз при импорте.
+_OPENAI_MODEL = os.getenv("OPENAI_MODEL")
+_OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+
+def get_agent_model() -> BaseChatModel:
+    """Модель агента; без OPENAI_MODEL/OPENAI_API_KEY падает сразу с понятной ошибкой."""
+    missing = [
+        name
+        for name, value in (("OPENAI_MODEL", _OPENAI_MODEL), ("OPENAI_API_KEY", _OPENAI_API_KEY))
+        if not value
+    ]
+    if missing:
+        raise RuntimeError(f"Не заданы переменные окружения: {', '.join(missing)}")
+    return get_chat_model(_OPENAI_MODEL, _OPENAI_API_KEY)
+
+
+def _tools_key(tools: list[BaseTool]) -> tuple[str, ...]:
+    return tuple(sorted(t.name for t in tools))
+
+
+def _get_bound_model(
+    mcp_port: int | None, tools: list[BaseTool]
+) -> Runnable[LanguageModelInput, BaseMessage]:
+    """Возвращает общую модель с bind_tools, не пересобирая её на каждый вызов."""
+    entry = _PORT_TOOLS.get(mcp_port) if mcp_port is not None else None
+    if entry is None:
+        return get_agent_model().bind_tools(tools)
+    key = _tools_key(tools)
+    bound = entry.bound_models.get(key)
+    if bound is None:
+        bound = entry.bound_models[key] = get_agent_model().bind_tools(tools)
+    return bound
 
 
 async def agent(state: State) -> State:
@@ -186,17 +319,7 @@ async def agent(state: State) -> State:
     try:
         t0 = time.perf_counter()
 
-        openai_proxy = os.getenv("OPENAI_PROXY_URL")
-        openai_model = os.getenv("OPENAI_MODEL")
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-
-        http_client = httpx.AsyncClient(proxy=openai_proxy, timeout=60.0)
-        model = init_chat_model(
-            model=openai_model,
-            temperature=0,
-            api_key=openai_api_key,
-            http_async_client=http_client,
-        ).bind_tools(state["tools"])
+        model = _get_bound_model(state["data"].get("mcp_port"), state["tools"])
 
         # Формируем сообщения с системным промптом
         messages = []
@@ -205,27 +328,40 @@ async def agent(state: State) -> State:
 
         # Добавляем историю сообщений
         messages.extend(state["messages"])
-        logger.info(f"🤖 Агент обрабатывает запрос: {state['messages'][-1].content}")
+        logger.info("🤖 Агент обрабатывает запрос: %s", state["messages"][-1].content)
 
         # Вызываем модель
         response = await model.ainvoke(messages)
 
         # Логируем результат
         if hasattr(response, "content") and response.content:
-            logger.info(f"✅ Агент ответил: {response.content[:100]}...")
+            logger.info("✅ Агент ответил: %s...", _LazyRepr(lambda: response.content[:100]))
         if hasattr(response, "tool_calls") and response.tool_calls:
             logger.info(
-                f"🔧 Вызов инструментов: {[tc['name'] for tc in response.tool_calls]}"
+                "🔧 Вызов инструментов: %s",
+                _LazyRepr(lambda: [tc["name"] for tc in response.tool_calls]),
             )
 
-        duration = round(time.perf_counter() - t0, 4)
+        duration = time.perf_counter() - t0
         return {
             "messages": [response],
             "time_all": duration,
             "time_node": [{"agent": duration}],
         }
     except Exception as err:
-        raise RuntimeError(f"{_func_name(0)}: ошибка в работе агента: {err}") from err
+        raise RuntimeError(f"agent: ошибка в работе агента: {err}") from err
+
+
+def _get_tool_node(mcp_port: int | None, tools: list[BaseTool]) -> ToolNode:
+    """Возвращает ToolNode для набора инструментов, создавая его один раз."""
+    entry = _PORT_TOOLS.get(mcp_port) if mcp_port is not None else None
+    if entry is None:
+        return ToolNode(tools)
+    key = _tools_key(tools)
+    tool_node = entry.tool_nodes.get(key)
+    if tool_node is None:
+        tool_node = entry.tool_nodes[key] = ToolNode(tools)
+    return tool_node
 
 
 async def tools_node(state: State) -> State:
@@ -234,10 +370,11 @@ async def tools_node(state: State) -> State:
         t0 = time.perf_counter()
 
         last_message = state["messages"][-1]
-        tool_node = ToolNode(state["tools"])
+        tool_node = _get_tool_node(state["data"].get("mcp_port"), state["tools"])
         # Логируем вызовы инструментов
         logger.info(
-            f"🔧 Выполнение инструментов: {[tc['name'] for tc in last_message.tool_calls]}"
+            "🔧 Выполнение инструментов: %s",
+            _LazyRepr(lambda: [tc["name"] for tc in last_message.tool_calls]),
         )
 
         # Вызываем инструменты
@@ -259,7 +396,7 @@ async def tools_node(state: State) -> State:
         }
         dialog_state_new = map_state.get(tools_name[-1], state["dialog_state"])
 
-        duration = round(time.perf_counter() - t0, 4)
+        duration = time.perf_counter() - t0
         result.update(
             {
                 "time_all": duration,
@@ -275,7 +412,7 @@ async def tools_node(state: State) -> State:
 
     except Exception as err:
         raise RuntimeError(
-            f"{_func_name(0)}: ошибка выполнения инструмента: {err}"
+            f"tools_node: ошибка выполнения инструмента: {err}"
         ) from err
 
 
@@ -286,7 +423,8 @@ async def should_continue(state: State) -> str:
         # Проверяем, есть ли tool_calls
         if hasattr(last_message, "tool_calls") and last_message.tool_calls:
             logger.info(
-                f"🔧 Вызов инструментов: {[tc['name'] for tc in last_message.tool_calls]}"
+                "🔧 Вызов инструментов: %s",
+                _LazyRepr(lambda: [tc["name"] for tc in last_message.tool_calls]),
             )
             return "tools"
         else:
@@ -295,10 +433,33 @@ async def should_continue(state: State) -> str:
 
     except Exception as err:
         raise RuntimeError(
-            f"{_func_name(0)}: ошибка условного ветвления: {err}"
+            f"should_continue: ошибка условного ветвления: {err}"
         ) from err
 
 
+def _extract_tokens(msg: BaseMessage) -> tuple[int, int, int]:
+    """Возвращает (input, output, total) токенов сообщения или нули."""
+    # 1) Прямой путь: usage_metadata на сообщении (AIMessage/HumanMessage могут иметь)
+    usage = getattr(msg, "usage_metadata", None)
+    if not usage or not isinstance(usage, dict):
+        # 2) Fallback: внутри response_metadata.token_usage (часто кладут SDK)
+        meta = getattr(msg, "response_metadata", None)
+        tu = meta.get("token_usage") if isinstance(meta, dict) else None
+        if not tu or not isinstance(tu, dict):
+            return 0, 0, 0
+        # нормализуем к единому виду
+        usage = {
+            "input_tokens": tu.get("prompt_tokens", tu.get("input_tokens", 0)),
+            "output_tokens": tu.get("completion_tokens", tu.get("output_tokens", 0)),
+            "total_tokens": tu.get("total_tokens", 0),
+        }
+
+    inp = int(usage.get("input_tokens", 0) or 0)
+    out = int(usage.get("output_tokens", 0) or 0)
+    tot = int(usage.get("total_tokens", 0) or (inp + out))
+    return inp, out, tot
+
+
 async def count_tokens(state: State) -> State:
     """Функция подсчета токенов."""
     try:
@@ -307,33 +468,10 @@ async def count_tokens(state: State) -> State:
         total_all = 0
 
         for msg in state.get("messages", []):
-            usage = {}
-            # 1) Прямой путь: usage_metadata на сообщении (AIMessage/HumanMessage могут иметь)
-            if hasattr(msg, "usage_metadata") and isinstance(msg.usage_metadata, dict):
-                usage = msg.usage_metadata or {}
-            # 2) Fallback: внутри response_metadata.token_usage (часто кладут SDK)
-            if not usage and hasattr(msg, "response_metadata"):
-                meta = msg.response_metadata or {}
-                if isinstance(meta, dict):
-                    tu = meta.get("token_usage") or {}
-                    if isinstance(tu, dict):
-                        # нормализуем к единому виду
-                        usage = {
-                            "input_tokens": tu.get(
-                                "prompt_tokens", tu.get("input_tokens", 0)
-                            ),
-                            "output_tokens": tu.get(
-                                "completion_tokens", tu.get("output_tokens", 0)
-                            ),
-                            "total_tokens": tu.get("total_tokens", 0),
-                        }
-            if usage:
-                inp = int(usage.get("input_tokens", 0) or 0)
-                out = int(usage.get("output_tokens", 0) or 0)
-                tot = int(usage.get("total_tokens", 0) or (inp + out))
-                total_input += inp
-                total_output += out
-                total_all += tot
+            inp, out, tot = _extract_tokens(msg)
+            total_input += inp
+            total_output += out
+            total_all += tot
 
         return {
             "tokens": {
@@ -344,5 +482,5 @@ async def count_tokens(state: State) -> State:
         }
     except Exception as err:
         raise RuntimeError(
-            f"{_func_name(0)}: ошибка при подсчете токенов: {err}"
+            f"count_tokens: ошибка при подсчете токенов: {err}"
         ) from err
@@ -0,0 +1,58 @@
+"""ASGI-приложение сервера LangGraph (ключ http.app в langgraph.json).
+
+Lifespan: прогрев графов при старте и закрытие общих ресурсов при остановке.
+Маршрут /metrics/graphs отдаёт счётчики кэша графов: JSON или, с ?format=prometheus,
+текстовый формат Prometheus (без зависимости от prometheus_client).
+"""
+
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from .zena_common import aclose_http_client, get_bool_env, logger
+from .zena_create_graph import graph_stats, warmup_all
+from .zena_postgres import close_pool
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    """Прогревает графы при старте и закрывает HTTP-клиент и пул Postgres при остановке."""
+    # GRAPH_WARMUP=1 — собрать все графы до первого запроса (в dev обычно выключено).
+    if get_bool_env("GRAPH_WARMUP"):
+        await warmup_all()
+    try:
+        yield
+    finally:
+        logger.info("shutdown: закрываем HTTP-клиент и пул Postgres")
+        await aclose_http_client()
+        await close_pool()
+
+
+def _prometheus_text(stats: dict[str, dict[str, int]]) -> str:
+    lines = ["# TYPE graph_cache_events_total counter"]
+    for name, counters in stats.items():
+        for status, value in counters.items():
+            if status != "built":
+                lines.append(f'graph_cache_events_total{{graph="{name}",status="{status}"}} {value}')
+    lines.append("# TYPE graph_cache_built gauge")
+    for name, counters in stats.items():
+        lines.append(f'graph_cache_built{{graph="{name}"}} {counters["built"]}')
+    return "\n".join(lines) + "\n"
+
+
+async def graphs_metrics(request: Request) -> Response:
+    """Счётчики кэша графов: JSON по умолчанию, текст Prometheus при ?format=prometheus."""
+    stats = graph_stats()
+    if request.query_params.get("format") == "prometheus":
+        return PlainTextResponse(_prometheus_text(stats), media_type="text/plain; version=0.0.4")
+    return JSONResponse(stats)
+
+
+app = Starlette(
+    routes=[Route("/metrics/graphs", graphs_metrics)],
+    lifespan=lifespan,
+)
@@ -2,35 +2,75 @@
 
 import os
 import asyncio
-import inspect
 import logging
 import random
+import aiohttp
 import httpx
 
-from functools import wraps
+from functools import lru_cache, wraps
 from pathlib import Path
 from dotenv import load_dotenv
-from typing_extensions import Any, Awaitable, Callable, TypeVar
+from typing_extensions import Any, AsyncIterator, Awaitable, Callable, Final, TypeVar
 
 from langchain.chat_models import init_chat_model
+from langchain_core.language_models import BaseChatModel
 
 
 T = TypeVar("T")
 
 # -------------------- Logging --------------------
-# Настройка логирования для вывода сообщений в консоль
-logging.basicConfig(
-    level=logging.INFO,  # минимальный уровень логирования INFO
-    format="%(asctime)s [%(levelname)s] %(message)s",  # формат: время [уровень] сообщение
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)  # создаём логгер для текущего модуля
 
 
-if not os.getenv("IS_DOCKER"):
-    ROOT = Path(__file__).resolve().parents[3]
-    dotenv_path = ROOT / "deploy" / "dev.env"
-    load_dotenv(dotenv_path=dotenv_path)
+def setup_logging() -> None:
+    """Настройка логирования для вывода сообщений в консоль.
+
+    Вызывается из точек входа (модули графов, main()), а не при импорте библиотечного кода.
+    Если у root-логгера уже есть обработчики, basicConfig ничего не меняет: под
+    langgraph dev/up формат (в том числе JSON по LOG_JSON и поля extra=) задаёт сервер.
+    """
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),  # минимальный уровень логирования (по умолчанию INFO)
+        format="%(asctime)s [%(levelname)s] %(message)s",  # формат: время [уровень] сообщение
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+
+class _LazyRepr:
+    """Откладывает построение строки для лога до момента записи.
+
+    logger вызывает str() у аргумента только если запись реально выводится,
+    поэтому при выключенном уровне func не вызывается вовсе.
+    """
+
+    __slots__ = ("_func",)
+
+    def __init__(self, func: Callable[[], Any]) -> None:
+        self._func = func
+
+    def __str__(self) -> str:
+        return str(self._func())
+
+
+_ENV_LOADED = False
+
+
+def load_env() -> None:
+    """Загружает deploy/dev.env вне Docker; повторные вызовы ничего не делают.
+
+    Флаг хранится в атрибуте модуля, поэтому файл читается один раз на процесс,
+    сколько бы модулей ни вызвали функцию.
+    """
+    global _ENV_LOADED
+    if _ENV_LOADED:
+        return
+    _ENV_LOADED = True
+    if not os.getenv("IS_DOCKER"):
+        root = Path(__file__).resolve().parents[3]
+        load_dotenv(dotenv_path=root / "deploy" / "dev.env")
+
+
+load_env()
 
 model_default = os.getenv("MODEL_DEFAULT")
 
@@ -44,15 +84,199 @@ anthropic_model = os.getenv("ANTHROPIC_MODEL")
 anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
 
 
-model_4o_mini = init_chat_model(
-    model=openai_model_4o_mini,
-    api_key=openai_api_key,
-    temperature=0,
-    http_async_client=httpx.AsyncClient(
-        proxy=openai_proxy,
-        timeout=60.0
-    ),
-)
+_TRUE_VALUES = frozenset({"1", "true", "yes", "on"})
+
+
+def get_bool_env(name: str, default: bool = False) -> bool:
+    """Читает булев флаг из окружения ("1", "true", "yes", "on" — истина)."""
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    return raw.strip().lower() in _TRUE_VALUES
+
+
+# -------------------- HTTP client --------------------
+# Один пул соединений на все модели: keepalive переиспользуется между вызовами LLM.
+openai_max_connections = int(os.getenv("OPENAI_MAX_CONN", "200"))
+openai_max_keepalive = int(os.getenv("OPENAI_MAX_KEEPALIVE", "50"))
+# HTTP/2 требует пакет h2 (httpx[http2]), которого нет в зависимостях проекта — по умолчанию выключен.
+openai_http2 = get_bool_env("OPENAI_HTTP2", default=False)
+
+# httpx (по умолчанию) или aiohttp — для высокой конкурентности вызовов LLM.
+llm_http_backend = (os.getenv("LLM_HTTP_BACKEND", "httpx") or "httpx").strip().lower()
+# Для aiohttp: все вызовы идут на один хост провайдера, поэтому лимит на хост
+# фактически и есть размер пула.
+llm_aiohttp_limit_per_host = int(os.getenv("LLM_AIOHTTP_LIMIT_PER_HOST", "50"))
+
+# Заголовки, которые aiohttp выставляет сам по фактическому телу запроса.
+_AIOHTTP_SKIP_HEADERS = frozenset({"host", "content-length", "transfer-encoding", "connection"})
+
+
+class _AiohttpResponseStream(httpx.AsyncByteStream):
+    """Тело ответа aiohttp в виде httpx-стрима (нужно для SSE/stream у OpenAI)."""
+
+    def __init__(self, response: aiohttp.ClientResponse) -> None:
+        """Оборачивает открытый ответ aiohttp; соединение освобождается в aclose()."""
+        self._response = response
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._response.content.iter_any():
+                yield chunk
+        except TimeoutError as e:
+            raise httpx.ReadTimeout(str(e) or "read timeout") from e
+        except aiohttp.ClientError as e:
+            raise httpx.ReadError(str(e)) from e
+
+    async def aclose(self) -> None:
+        """Возвращает соединение ответа в пул aiohttp."""
+        self._response.release()
+
+
+class AiohttpTransport(httpx.AsyncBaseTransport):
+    """httpx-транспорт поверх одного aiohttp.ClientSession.
+
+    Позволяет отдать aiohttp в init_chat_model(http_async_client=...) без
+    изменений в коде моделей. Сессия создаётся лениво — aiohttp требует
+    запущенный event loop.
+    """
+
+    def __init__(
+        self,
+        proxy: str | None = None,
+        limit: int = 200,
+        limit_per_host: int = 50,
+        ttl_dns_cache: int = 300,
+        keepalive_timeout: float = 30.0,
+    ) -> None:
+        """Запоминает параметры пула; сама сессия создаётся при первом запросе."""
+        self._proxy = proxy
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._ttl_dns_cache = ttl_dns_cache
+        self._keepalive_timeout = keepalive_timeout
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self._limit,
+                    limit_per_host=self._limit_per_host,
+                    ttl_dns_cache=self._ttl_dns_cache,
+                    # как keepalive_expiry у httpx-пула
+                    keepalive_timeout=self._keepalive_timeout,
+                ),
+                # Распаковкой занимается httpx по Content-Encoding
+                auto_decompress=False,
+                trust_env=self._proxy is None,
+            )
+        return self._session
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Выполняет запрос через aiohttp, переводя его ошибки в исключения httpx."""
+        timeouts = request.extensions.get("timeout", {})
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=timeouts.get("pool"),
+            sock_connect=timeouts.get("connect"),
+            sock_read=timeouts.get("read"),
+        )
+        headers = [
+            (k, v)
+            for k, v in request.headers.multi_items()
+            if k.lower() not in _AIOHTTP_SKIP_HEADERS
+        ]
+        body = await request.aread()
+
+        try:
+            response = await self._get_session().request(
+                request.method,
+                str(request.url),
+                headers=headers,
+                data=body or None,
+                proxy=self._proxy,
+                timeout=timeout,
+                allow_redirects=False,
+            )
+        except aiohttp.ConnectionTimeoutError as e:
+            raise httpx.ConnectTimeout(str(e) or "connect timeout", request=request) from e
+        except TimeoutError as e:
+            raise httpx.ReadTimeout(str(e) or "read timeout", request=request) from e
+        except aiohttp.ClientConnectorError as e:
+            raise httpx.ConnectError(str(e), request=request) from e
+        except aiohttp.ClientError as e:
+            raise httpx.ReadError(str(e), request=request) from e
+
+        return httpx.Response(
+            status_code=response.status,
+            headers=list(response.raw_headers),
+            stream=_AiohttpResponseStream(response),
+            request=request,
+        )
+
+    async def aclose(self) -> None:
+        """Закрывает сессию aiohttp, если она была открыта."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+def make_http_async_client(proxy: str | None = None) -> httpx.AsyncClient:
+    """Создаёт httpx.AsyncClient с явными лимитами пула для вызовов LLM.
+
+    При LLM_HTTP_BACKEND=aiohttp сетевой слой отдаётся AiohttpTransport.
+    """
+    if llm_http_backend == "aiohttp":
+        return httpx.AsyncClient(
+            transport=AiohttpTransport(
+                proxy=proxy,
+                limit=openai_max_connections,
+                limit_per_host=llm_aiohttp_limit_per_host,
+            ),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            # Прокси уже передан в транспорт; env-прокси httpx смонтировал бы мимо aiohttp
+            trust_env=False,
+        )
+
+    return httpx.AsyncClient(
+        proxy=proxy,
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=openai_max_connections,
+            max_keepalive_connections=openai_max_keepalive,
+            keepalive_expiry=30.0,
+        ),
+        http2=openai_http2,
+    )
+
+
+http_async_client = make_http_async_client(openai_proxy)
+
+
+async def aclose_http_client() -> None:
+    """Закрывает общий HTTP-клиент моделей (и сессию aiohttp, если она есть).
+
+    Вызывается при остановке сервера; atexit здесь не подходит — закрытие асинхронное.
+    """
+    await http_async_client.aclose()
+
+
+@lru_cache(maxsize=8)
+def get_chat_model(model_name: str | None, api_key: str | None) -> BaseChatModel:
+    """Возвращает общий экземпляр OpenAI-модели для пары (модель, ключ).
+
+    Все графы и модули получают один и тот же объект поверх общего
+    http_async_client, а не создают свой при каждом импорте.
+    """
+    return init_chat_model(
+        model=model_name,
+        api_key=api_key,
+        temperature=0,
+        http_async_client=http_async_client,
+    )
+
+
+model_4o_mini = get_chat_model(openai_model_4o_mini, openai_api_key)
 
 
 model_anthropic = init_chat_model(
@@ -63,26 +287,8 @@ model_anthropic = init_chat_model(
 )
 
 
-model_4o_mini_reserv = init_chat_model(
-    model=openai_model_4o_mini,
-    api_key=openai_api_key_reserv,
-    temperature=0,
-    http_async_client=httpx.AsyncClient(
-        proxy=openai_proxy,
-        timeout=60.0
-    ),
-)
-
-
-model_4o = init_chat_model(
-    model=openai_model_4o,
-    api_key=openai_api_key,
-    temperature=0,
-    http_async_client=httpx.AsyncClient(
-        proxy=openai_proxy,
-        timeout=60.0
-    ),
-)
+model_4o_mini_reserv = get_chat_model(openai_model_4o_mini, openai_api_key_reserv)
+model_4o = get_chat_model(openai_model_4o, openai_api_key)
 
 model_ai = model_anthropic if model_default=='anthropic' else model_4o_mini
 
@@ -91,16 +297,20 @@ model_ai = model_anthropic if model_default=='anthropic' else model_4o_mini
 def retry_async(
     retries: int = 3,
     backoff: float = 2.0,
-    jitter: float = 1.0,
+    cap: float = 30.0,
     exceptions: tuple[type[Exception], ...] = (Exception,),
 ) -> Any:
-    """Декоратор для асинхронных ретраев с экспоненциальным бэкоффом и равномерным джиттером.
+    """Декоратор для асинхронных ретраев с экспоненциальным бэкоффом и full jitter.
+
+    Пауза перед повтором — случайная в [0, min(cap, backoff^attempt)): параллельные
+    корутины, упавшие на одном ресурсе, не повторяют запрос одновременно.
 
     Args:
         retries: общее число попыток (по умолчанию 3)
         backoff: базовый коэффициент экспоненты (например, 2.0 => 2^attempt)
-        jitter: амплитуда добавочного шума [0, jitter)
+        cap: верхняя граница паузы, сек
         exceptions: кортеж типов исключений, которые нужно ретраить
+            (отмена задачи и KeyboardInterrupt не ретраятся никогда)
 
     Example:
         @retry_async()
@@ -113,24 +323,50 @@ def retry_async(
     """
 
     def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        _exc = exceptions
+        if retries <= 1:
+            # Повторов нет — обходимся без цикла и расчёта пауз.
+            @wraps(func)
+            async def single(*args: Any, **kwargs: Any) -> T:
+                try:
+                    return await func(*args, **kwargs)
+                except (asyncio.CancelledError, KeyboardInterrupt):
+                    raise
+                except _exc as e:
+                    logger.exception("Последняя неудачная попытка %s: %s", func.__name__, e)
+                    raise
+
+            return single
+
+        # Верхние границы пауз известны при декорировании: min(cap, backoff**attempt)
+        waits = tuple(min(cap, backoff**attempt) for attempt in range(1, retries))
+        _sleep = asyncio.sleep
+        _rand = random.random
+
         @wraps(func)
         async def wrapper(*args: Any, **kwargs: Any) -> T:
             for attempt in range(1, retries + 1):
                 try:
                     return await func(*args, **kwargs)
-                except exceptions as e:
+                except (asyncio.CancelledError, KeyboardInterrupt):
+                    raise
+                except _exc as e:
                     if attempt == retries:
                         logger.exception(
-                            f"Последняя неудачная попытка {func.__name__}: {e}"
+                            "Последняя неудачная попытка %s: %s", func.__name__, e
                         )
                         raise
-                    wait = (backoff**attempt) + random.uniform(0, jitter)
+                    wait = _rand() * waits[attempt - 1]
                     logger.warning(
-                        f"Ошибка в {func.__name__}: {e} | "
-                        f"попытка {attempt}/{retries} — повтор через {wait:.1f}s"
+                        "Ошибка в %s: %s | попытка %d/%d — повтор через %.1fs",
+                        func.__name__,
+                        e,
+                        attempt,
+                        retries,
+                        wait,
                     )
                     # Неблокирующее ожидание — не мешает другим корутинам
-                    await asyncio.sleep(wait)
+                    await _sleep(wait)
 
             # Эта строка никогда не должна быть достигнута
             raise RuntimeError(f"{func.__name__}: исчерпаны все попытки")
@@ -140,16 +376,31 @@ def retry_async(
     return decorator
 
 
-def _func_name(depth: int = 0) -> str:
-    # depth=0 — текущая, 1 — вызывающая, 2 — её вызывающая
-    frame = inspect.currentframe()
-    for _ in range(depth + 1):
-        if frame is None:
-            return "<unknown>"
-        frame = frame.f_back
-    if frame is None:
-        return "<unknown>"
-    return frame.f_code.co_name
+# -------------------- Predefined messages --------------------
+# Сообщения из httpservice на запрещенные темы, которые передаем клиенту через бота.
+PREDEFINED_MESSAGES: Final[frozenset[str]] = frozenset({
+    "Ваше сообщение не может быть обработано 🚫",
+    "Пожалуйста, отправьте корректные данные 🙏",
+    "Мы не можем принять это сообщение ❌",
+    "Ай-ай-ай, ругаться плохо!",
+    "Давайте без таких слов 🙂",
+    "Попробуйте выразиться по-другому 😉",
+    "Нехорошо так говорить 😇",
+    "Давайте держать общение в позитивном ключе!",
+})
+
+# По этому кодовому слову чистится история диалога.
+PREDEFINED_STOP: Final = "стоп"
+# По этому кодовому слову удаляются персональные данные.
+PREDEFINED_DEL_PERSONAL_DATA: Final = "phone"
+
+
+def _is_keyword(text: str, keyword: str) -> bool:
+    """Сравнивает text с кодовым словом (keyword в нижнем регистре) без учёта регистра.
+
+    Проверка длины отсекает почти все сообщения без аллокации text.lower().
+    """
+    return len(text) == len(keyword) and text.lower() == keyword
 
 
 def _content_to_text(content: str | list[Any] | None) -> str:
@@ -160,13 +411,18 @@ def _content_to_text(content: str | list[Any] | None) -> str:
     Особенность Langgraph Studio.
     """
     # logger.info("_content_to_text")
-    if isinstance(content, str):
+    # Быстрый путь: в проде content почти всегда обычная строка.
+    if type(content) is str:
         return content
     if isinstance(content, list) and content:
         part = content[0]
         if isinstance(part, dict):
-            if "text" in part and isinstance(part["text"], str):
-                return part["text"]
-            if "content" in part and isinstance(part["content"], str):
-                return part["content"]
+            text = part.get("text")
+            if isinstance(text, str):
+                return text
+            text = part.get("content")
+            if isinstance(text, str):
+                return text
+    elif isinstance(content, str):
+        return content
     return ""
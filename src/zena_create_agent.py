@@ -1,10 +1,18 @@
 """Модуль описывающий ноды графа."""
 
-import httpx
+import asyncio
+import os
+import random
 import re
+import time
+from dataclasses import dataclass
+from typing import Any, TypeAlias
+
+import httpx
 
-from langchain.agents import create_agent
-from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain.agents import AgentState, create_agent
+from langchain_mcp_adapters.sessions import SSEConnection
+from langchain_mcp_adapters.tools import load_mcp_tools
 from langchain_core.tools.base import BaseTool
 from langgraph.graph.state import CompiledStateGraph
 
@@ -20,7 +28,7 @@ from langchain.agents.middleware import (
 )
 
 
-from .zena_common import logger, model_4o, model_4o_mini, model_4o_mini_reserv, model_ai
+from .zena_common import _LazyRepr, logger, model_4o, model_4o_mini, model_4o_mini_reserv, model_ai, setup_logging
 from .zena_state import State, Context
 # from .zena_memory import memory
 
@@ -55,27 +63,244 @@ from .zena_middleware_after_model import (
 from .zena_state import State
 
 
-async def create_agent_mcp(mcp_port: int) -> CompiledStateGraph:
+# -------------------- MCP tools --------------------
+MCP_HOST = "172.17.0.1"
+MCP_TOOLS_RETRIES = int(os.getenv("MCP_TOOLS_RETRIES", "3"))
+MCP_TOOLS_TIMEOUT_S = float(os.getenv("MCP_TOOLS_TIMEOUT_S", "10"))
+MCP_BACKOFF_BASE_S = float(os.getenv("MCP_BACKOFF_BASE_S", "0.5"))
+MCP_BACKOFF_CAP_S = 5.0
+MCP_TOOLS_CACHE_TTL_S = float(os.getenv("MCP_TOOLS_CACHE_TTL_S", "60"))
+MCP_BREAKER_FAIL_MAX = int(os.getenv("MCP_BREAKER_FAIL_MAX", "5"))
+MCP_BREAKER_COOLDOWN_S = float(os.getenv("MCP_BREAKER_COOLDOWN_S", "30"))
+MCP_MAX_INFLIGHT = int(os.getenv("MCP_MAX_INFLIGHT", "4"))
+
+# Подключение на порт: одно описание SSE-сервера для всех агентов этого порта.
+_MCP_CONNECTIONS: dict[int, SSEConnection] = {}
+# port -> (время загрузки по time.monotonic(), инструменты)
+_TOOLS_CACHE: dict[int, tuple[float, list[BaseTool]]] = {}
+# Загрузки в процессе: параллельные вызовы для одного порта ждут одну задачу.
+_INFLIGHT: dict[int, asyncio.Task[list[BaseTool]]] = {}
+
+
+@dataclass
+class _Breaker:
+    """Автомат closed -> open -> half_open для одного порта MCP."""
+
+    state: str = "closed"
+    fails: int = 0
+    opened_at: float = 0.0
+
+
+_BREAKERS: dict[int, _Breaker] = {}
+
+# Ограничение одновременных загрузок на хост MCP (по порту их и так не больше одной).
+_MCP_SEMAPHORES: dict[str, asyncio.Semaphore] = {}
+
+
+def _get_mcp_semaphore(host: str) -> asyncio.Semaphore:
+    sem = _MCP_SEMAPHORES.get(host)
+    if sem is None:
+        sem = _MCP_SEMAPHORES[host] = asyncio.Semaphore(MCP_MAX_INFLIGHT)
+    return sem
+
+
+def _get_mcp_connection(mcp_port: int) -> SSEConnection:
+    connection = _MCP_CONNECTIONS.get(mcp_port)
+    if connection is None:
+        connection = _MCP_CONNECTIONS[mcp_port] = SSEConnection(
+            transport="sse",
+            url=f"http://{MCP_HOST}:{mcp_port}/sse",
+        )
+    return connection
+
+
+async def _get_tools_safe(mcp_port: int) -> list[BaseTool]:
+    """Инструменты MCP-сервера с кэшем на MCP_TOOLS_CACHE_TTL_S (0 — без кэша)."""
+    entry = _TOOLS_CACHE.get(mcp_port)
+    if entry is not None and time.monotonic() - entry[0] < MCP_TOOLS_CACHE_TTL_S:
+        return entry[1]
+
+    task = _INFLIGHT.get(mcp_port)
+    if task is None:
+        breaker = _BREAKERS.get(mcp_port)
+        if breaker is None:
+            breaker = _BREAKERS[mcp_port] = _Breaker()
+        if breaker.state == "open":
+            if time.monotonic() - breaker.opened_at < MCP_BREAKER_COOLDOWN_S:
+                logger.warning("MCP port=%s breaker=open — skip get_tools", mcp_port)
+                raise RuntimeError(f"MCP-сервер на порту {mcp_port} недоступен")
+            # Окно истекло: пропускаем одну пробную загрузку, остальные ждут её через _INFLIGHT.
+            breaker.state = "half_open"
+
+        task = asyncio.get_running_loop().create_task(_load_tools(mcp_port, breaker))
+        task.add_done_callback(_consume_exception)
+        _INFLIGHT[mcp_port] = task
+
+    # shield: отмена любого вызывающего (в том числе первого) не отменяет общую загрузку
+    return await asyncio.shield(task)
+
+
+async def _load_tools(mcp_port: int, breaker: _Breaker) -> list[BaseTool]:
+    """Загрузка в отдельной задаче: кэш и автомат обновляются независимо от вызывающих."""
+    try:
+        tools = await _fetch_tools(mcp_port)
+    except asyncio.CancelledError:
+        # Отменили саму загрузку (остановка цикла) — это не отказ сервера.
+        if breaker.state == "half_open":
+            breaker.state = "open"
+        raise
+    except Exception:
+        _TOOLS_CACHE.pop(mcp_port, None)
+        breaker.fails += 1
+        if breaker.state == "half_open" or breaker.fails >= MCP_BREAKER_FAIL_MAX:
+            breaker.state = "open"
+            breaker.opened_at = time.monotonic()
+            logger.error("MCP port=%s breaker=open after %d failures", mcp_port, breaker.fails)
+        raise
+    else:
+        breaker.state = "closed"
+        breaker.fails = 0
+        if MCP_TOOLS_CACHE_TTL_S > 0:
+            _TOOLS_CACHE[mcp_port] = (time.monotonic(), tools)
+        return tools
+    finally:
+        _INFLIGHT.pop(mcp_port, None)
+
+
+def _consume_exception(task: asyncio.Task[list[BaseTool]]) -> None:
+    # Если все ожидающие отменились, ошибку загрузки никто не прочитает — читаем здесь.
+    if not task.cancelled():
+        task.exception()
+
+
+async def _fetch_tools(mcp_port: int) -> list[BaseTool]:
+    """Получение инструментов из MCP-сервера по выбранному порту.
+
+    Каждая попытка ограничена MCP_TOOLS_TIMEOUT_S, между попытками — full jitter.
+    После последней неудачи исключение пробрасывается: агент без инструментов не собираем.
+    """
+    _sleep = asyncio.sleep
+    _rand = random.random
+    sem = _get_mcp_semaphore(MCP_HOST)
+    connection = _get_mcp_connection(mcp_port)
+    for attempt in range(1, MCP_TOOLS_RETRIES + 1):
+        try:
+            async with sem, asyncio.timeout(MCP_TOOLS_TIMEOUT_S):
+                # Сервер один — без MultiServerMCPClient: сессия открывается на вызов.
+                return await load_mcp_tools(None, connection=connection)
+        except Exception as e:
+            if attempt == MCP_TOOLS_RETRIES:
+                logger.exception("MCP get_tools port=%s failed after %d attempts", mcp_port, attempt)
+                raise
+            wait = _rand() * min(MCP_BACKOFF_CAP_S, MCP_BACKOFF_BASE_S * 2 ** (attempt - 1))
+            logger.warning(
+                "MCP get_tools port=%s attempt %d/%d failed: %r — retry in %.2fs",
+                mcp_port,
+                attempt,
+                MCP_TOOLS_RETRIES,
+                e,
+                wait,
+            )
+            await _sleep(wait)
+
+    raise RuntimeError(f"_fetch_tools: исчерпаны все попытки для порта {mcp_port}")
+
+
+# Middleware без состояния на экземпляре: создаются один раз и общие для всех агентов.
+_BASE_MIDDLEWARE = (
+    VerifyInputMessage(),
+    GetDatabaseMiddleware(),
+    GetKeyWordMiddleware(),
+    # GetCRMGOMiddleware(),
+    # DynamicMCPPortMiddleware(),
+    DynamicSystemPrompt(),
+    # personalized_prompt,
+    ToolSelectorMiddleware(),
+    # SaveResultToolsMiddleware(),
+    TrimMessages(),
+    ToolMonitoringMiddleware(),
+    GetCountToken(),
+    GetToolArgs(),
+    GetCRMGOOnboardStage(),
+    ResetData(),
+    SaveResponceAgent(),
+    ContextEditingMiddleware(
+        edits=[
+            ClearToolUsesEdit(
+                trigger=2000,
+                keep=2,
+                clear_tool_inputs=False,
+                exclude_tools=[],
+                placeholder="[cleared]",
+            ),
+        ],
+    ),
+    # PIIMiddleware(
+    #     "phone",
+    #     detector = re.compile(r'^(\+?7|8)?[\s.-]?(\(?\d{3,5}\)?)?[\s.-]?\d{3}[\s.-]?\d{2}[\s.-]?\d{2}$'),
+    #     strategy="mask",
+    # ),
+    # PIIMiddleware(
+    #     "email",
+    #     strategy="mask",
+    # ),
+
+    # ToolRetryMiddleware(
+    #     max_retries=1,
+    #     backoff_factor=2.0,
+    #     initial_delay=1.0,
+    #     on_failure='return_message'
+    # ),
+
+    # SummarizationMiddleware(
+    #     model=model_4o_mini,
+    #     max_tokens_before_summary=4000,
+    #     messages_to_keep=10,
+    # ),
+
+    # LLMToolSelectorMiddleware(
+    #     model=model_4o_mini,
+    #     max_tools=2,
+    # ),
+)
+
+
+# Модели создаются в zena_common при импорте и не меняются — резерв фиксируем здесь же.
+_FALLBACK_MIDDLEWARE = ModelFallbackMiddleware(
+    model_ai,
+    model_4o_mini_reserv,
+)
+# ResponseT = Any: агент работает без структурированного ответа.
+_TOOL_CALL_LIMIT: ToolCallLimitMiddleware[Any, Context] = ToolCallLimitMiddleware(
+    run_limit=20,
+)
 
-    async def _get_tools(mcp_port: int) -> list[BaseTool]:
-        """Получение инструментов из MCP-сервера по выбранному порту."""
 
-        url = f"http://172.17.0.1:{mcp_port}/sse"
-        client = MultiServerMCPClient(
-            {
-                "company": {
-                    "transport": "sse",
-                    "url": url,
-                }
-            }
+# (port, набор имён инструментов) -> собранный агент; на порт хранится одна запись.
+# Граф create_agent: вход/выход — внутренние схемы langchain, поэтому Any.
+McpAgent: TypeAlias = CompiledStateGraph[AgentState[Any], Any, Any, Any]
+
+_AGENT_CACHE: dict[tuple[int, frozenset[str]], McpAgent] = {}
+
+
+async def create_agent_mcp(mcp_port: int) -> McpAgent:
+
+    t0 = time.perf_counter_ns()
+    tools = await _get_tools_safe(mcp_port)
+    t1 = time.perf_counter_ns()
+
+    key = (mcp_port, frozenset(tool.name for tool in tools))
+    agent = _AGENT_CACHE.get(key)
+    if agent is not None:
+        logger.info(
+            "create_agent_mcp cached (%s) tools_ms=%d", mcp_port, (t1 - t0) // 1_000_000
         )
-        return await client.get_tools()
+        return agent
 
-    tools = await _get_tools(mcp_port)
-    
-    tools_name = [tool.name for tool in tools]
-    logger.info(f"create_agent_mcp tools ({mcp_port}): {tools_name}")
-    logger.info(f"model_ai: {model_ai}")
+    logger.info(
+        "create_agent_mcp tools (%s): %s", mcp_port, _LazyRepr(lambda: [t.name for t in tools])
+    )
+    logger.info("model_ai: %s", model_ai)
 
     agent = create_agent( 
         model=model_ai,
@@ -84,97 +309,34 @@ async def create_agent_mcp(mcp_port: int) -> CompiledStateGraph:
         system_prompt='Ты полезный помошник',
         tools=tools,
         middleware=[
-            VerifyInputMessage(),
-            GetDatabaseMiddleware(),
-            GetKeyWordMiddleware(),
-            # GetCRMGOMiddleware(),
-            # DynamicMCPPortMiddleware(),
-            DynamicSystemPrompt(),
-            # personalized_prompt,
-            ToolSelectorMiddleware(),
-            # SaveResultToolsMiddleware(),
-            TrimMessages(),
-            ToolMonitoringMiddleware(),
-            GetCountToken(),
-            GetToolArgs(),
-            GetCRMGOOnboardStage(),
-            ResetData(),
-            SaveResponceAgent(),
-            
-            ContextEditingMiddleware(
-                edits=[
-                    ClearToolUsesEdit(
-                        trigger=2000,
-                        keep=2,
-                        clear_tool_inputs=False,
-                        exclude_tools=[],
-                        placeholder="[cleared]",
-                    ),
-                ],
-            ),
-            ModelFallbackMiddleware(
-                model_ai,
-                model_4o_mini_reserv,
-            ),
-            ToolCallLimitMiddleware(
-                run_limit=20,
-            )
-            # PIIMiddleware(
-            #     "phone",
-            #     detector = re.compile(r'^(\+?7|8)?[\s.-]?(\(?\d{3,5}\)?)?[\s.-]?\d{3}[\s.-]?\d{2}[\s.-]?\d{2}$'),
-            #     strategy="mask",
-            # ),
-            # PIIMiddleware(
-            #     "email",
-            #     strategy="mask",
-            # ),
-
-            # ToolRetryMiddleware(
-            #     max_retries=1,
-            #     backoff_factor=2.0,
-            #     initial_delay=1.0,
-            #     on_failure='return_message'
-            # ),
-
-            # SummarizationMiddleware(
-            #     model=model_4o_mini,
-            #     max_tokens_before_summary=4000,
-            #     messages_to_keep=10,
-            # ),
-
-            # LLMToolSelectorMiddleware(
-            #     model=model_4o_mini,
-            #     max_tools=2,
-            # ),
+            *_BASE_MIDDLEWARE,
+            _FALLBACK_MIDDLEWARE,
+            _TOOL_CALL_LIMIT,
         ]
     )
+    # Набор инструментов порта изменился — прежний агент больше не нужен.
+    for stale in [k for k in _AGENT_CACHE if k[0] == mcp_port]:
+        del _AGENT_CACHE[stale]
+    _AGENT_CACHE[key] = agent
+    t2 = time.perf_counter_ns()
+    logger.info(
+        "create_agent_mcp done (%s) tools_ms=%d agent_ms=%d",
+        mcp_port,
+        (t1 - t0) // 1_000_000,
+        (t2 - t1) // 1_000_000,
+    )
     return agent
 
-import asyncio
 async def main():
-    async def _get_tools(mcp_port: int) -> list[BaseTool]:
-        """Получение инструментов из MCP-сервера по выбранному порту."""
-
-        url = f"http://172.17.0.1:{mcp_port}/sse"
-        client = MultiServerMCPClient(
-            {
-                "company": {
-                    "transport": "sse",
-                    "url": url,
-                }
-            }
-        )
-        return await client.get_tools()
-
     mcp_port = [5020]
     for port in mcp_port:
-        tools = await _get_tools(port)
+        tools = await _get_tools_safe(port)
 
-        tools_name = [tool.name for tool in tools]
-        logger.info(f"create_agent_mcp tools ({port}): {tools_name}")
+        logger.info("create_agent_mcp tools (%s): %s", port, [t.name for t in tools])
 
 
 if __name__ == "__main__":
+    setup_logging()
     asyncio.run(main())
 
 
@@ -2,45 +2,265 @@
 
 import os
 import asyncio
+import time
+from collections.abc import Awaitable, Callable, Mapping
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, TypeAlias
 
-from langgraph.graph import END, START, StateGraph
+from langgraph.graph import END, START
+from langgraph.graph.state import CompiledStateGraph
 
+from .zena_common import get_bool_env, logger, setup_logging
 from .zena_create_agent import create_agent_mcp
-from .zena_state import Context, InputState, OutputState, State
+from .zena_middleware_wrap_model import DynamicSystemPrompt
+from .zena_postgres import get_pool
+from .zena_state import Context, InputState, OutputState, State, new_workflow
 
 
-async def create_agent_graph(port: int):
+setup_logging()
+
+if TYPE_CHECKING:
+    from opentelemetry.trace import Tracer
+
+# OpenTelemetry приходит транзитивно; без него спаны не создаются.
+_tracer: "Tracer | None"
+try:
+    from opentelemetry import trace
+
+    _tracer = trace.get_tracer("zena.graph")
+except ImportError:
+    _tracer = None
+
+
+def _span(name: str, **attributes: str | int) -> AbstractContextManager[Any]:
+    """Спан OTel с атрибутами или пустой контекст, если OTel не установлен."""
+    tracer = _tracer
+    if tracer is None:
+        return nullcontext()
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+
+# Граф компании: схемы из new_workflow().
+AgentGraph: TypeAlias = CompiledStateGraph[State, Context, InputState, OutputState]
+
+
+async def create_agent_graph(port: int) -> AgentGraph:
     """Универсальная фабрика для LangGraph CLI."""
-    
-    agent = await create_agent_mcp(mcp_port=port)
-    
-    workflow = StateGraph(
-        state_schema=State,
-        input_schema=InputState,
-        output_schema=OutputState,
-        context_schema=Context,
+
+    with _span("zena.graph.create_agent_mcp", mcp_port=port):
+        agent = await create_agent_mcp(mcp_port=port)
+
+    with _span("zena.graph.compile", mcp_port=port):
+        workflow = new_workflow()
+        workflow.add_node("agent", agent)
+        workflow.add_edge(START, "agent")
+        workflow.add_edge("agent", END)
+        return workflow.compile()
+
+
+# (имя графа, порт MCP по умолчанию); переменная окружения — MCP_PORT_<ИМЯ>.
+# В dev-окружении используются порты 15xxx.
+_PORT_SPECS = (
+    ("sofia", 5002),
+    ("anisa", 5005),
+    ("annitta", 5006),
+    ("anastasia", 5007),
+    ("alena", 5020),
+    ("valentina", 5021),
+    ("marina", 5024),
+    ("egoistka", 5017),
+)
+
+
+def _get_int_env(name: str, default: int) -> int:
+    """Целое из переменной окружения; пустая или отсутствующая — default."""
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        raise RuntimeError(f"{name} должен быть целым числом, получено {raw!r}") from None
+
+
+def _read_ports() -> dict[str, int]:
+    """Читает порты MCP всех компаний за один проход."""
+    ports: dict[str, int] = {}
+    for name, default in _PORT_SPECS:
+        env_name = f"MCP_PORT_{name.upper()}"
+        port = _get_int_env(env_name, default)
+        if not 1 <= port <= 65535:
+            raise RuntimeError(f"{env_name}: недопустимый порт MCP {port}")
+        ports[name] = port
+    return ports
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Настройки графов из окружения; читаются и проверяются один раз на процесс."""
+
+    mcp_ports: Mapping[str, int]
+    graph_cache_ttl_s: float  # 0 — граф живёт до перезапуска процесса
+    graph_cache_force_reload: bool  # dev: пересобирать граф на каждый вызов фабрики
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Настройки из окружения, собранные один раз и закэшированные на процесс."""
+    return Settings(
+        mcp_ports=MappingProxyType(_read_ports()),
+        graph_cache_ttl_s=float(os.getenv("GRAPH_CACHE_TTL_S", "0")),
+        graph_cache_force_reload=get_bool_env("GRAPH_CACHE_FORCE_RELOAD"),
     )
-    workflow.add_node("agent", agent)
-    workflow.add_edge(START, "agent")
-    workflow.add_edge("agent", END)
-    
-    return workflow.compile()
-
-
-MCP_PORT_SOFIA = os.getenv("MCP_PORT_SOFIA") # 5002 / 15002
-MCP_PORT_ANISA = os.getenv("MCP_PORT_ANISA") # 5005 / 15005
-MCP_PORT_ANNITTA = os.getenv("MCP_PORT_ANNITTA") # 5006 / 15006
-MCP_PORT_ANASTASIA = os.getenv("MCP_PORT_ANASTASIA") # 5007 / 15007
-MCP_PORT_ALENA = os.getenv("MCP_PORT_ALENA") # 5020 / 15020
-MCP_PORT_VALENTINA = os.getenv("MCP_PORT_VALENTINA") # 5021 / 15021
-MCP_PORT_MARINA = os.getenv("MCP_PORT_MARINA") # 5024 / 15024
-MCP_PORT_EGOISTKA = os.getenv("MCP_PORT_EGOISTKA") # 5017 / 15017
-
-graph_sofia = asyncio.run(create_agent_graph(MCP_PORT_SOFIA))
-graph_anisa = asyncio.run(create_agent_graph(MCP_PORT_ANISA))
-graph_annitta = asyncio.run(create_agent_graph(MCP_PORT_ANNITTA))
-graph_anastasia = asyncio.run(create_agent_graph(MCP_PORT_ANASTASIA))
-graph_alena = asyncio.run(create_agent_graph(MCP_PORT_ALENA))
-graph_valentina = asyncio.run(create_agent_graph(MCP_PORT_VALENTINA))
-graph_marina = asyncio.run(create_agent_graph(MCP_PORT_MARINA))
-graph_egoistka = asyncio.run(create_agent_graph(MCP_PORT_EGOISTKA))
+
+
+# Набор компаний фиксирован при импорте — снаружи только для чтения.
+MCP_PORTS = get_settings().mcp_ports
+_GRAPH_TTL_S = get_settings().graph_cache_ttl_s
+_FORCE_RELOAD = get_settings().graph_cache_force_reload
+_KNOWN_GRAPHS = ", ".join(MCP_PORTS)
+
+# Шаблоны промптов компилируются до сборки графов (fail-fast на ошибках Jinja).
+DynamicSystemPrompt.preload_templates()
+
+# Графы собираются лениво при первом запросе и дальше переиспользуются.
+# Параллельные промахи по одному имени ждут одну и ту же задачу сборки (single-flight).
+_registry: dict[str, AgentGraph] = {}
+_built_at: dict[str, float] = {}  # time.monotonic() момента сборки
+_inflight: dict[str, asyncio.Task[AgentGraph]] = {}
+# Прогрев общих ресурсов: одна задача на процесс, запускается при первой сборке графа.
+_resources_task: asyncio.Task[None] | None = None
+
+
+async def _init_resources() -> None:
+    """Открывает пул Postgres заранее; при ошибке пул создастся при первом запросе."""
+    try:
+        await get_pool()
+    except Exception as err:
+        logger.warning("init_resources: пул Postgres не создан: %r", err)
+
+
+def _start_resources() -> asyncio.Task[None]:
+    global _resources_task
+    if _resources_task is None:
+        _resources_task = asyncio.get_running_loop().create_task(_init_resources())
+    return _resources_task
+
+
+# Счётчики кэша графов: попадания не логируются, только считаются.
+# Каждый вызов get_graph попадает ровно в один из hits/misses/expired/joined
+# (joined — присоединился к уже идущей сборке).
+_STAT_KEYS = ("hits", "misses", "expired", "joined", "build_errors")
+_stats: dict[str, dict[str, int]] = {name: dict.fromkeys(_STAT_KEYS, 0) for name in MCP_PORTS}
+
+
+def graph_stats() -> dict[str, dict[str, int]]:
+    """Снимок счётчиков кэша по каждому графу (для эндпоинта метрик)."""
+    return {
+        name: {**counters, "built": int(name in _registry)}
+        for name, counters in _stats.items()
+    }
+
+
+# Поля структурного лога на компанию — собираются один раз, а не на каждый вызов.
+_LOG_EXTRA = {name: {"graph": name, "port": port} for name, port in MCP_PORTS.items()}
+
+
+def _is_fresh(name: str) -> bool:
+    """Граф собран и не старше GRAPH_CACHE_TTL_S (при TTL 0 — всегда свежий)."""
+    return not _FORCE_RELOAD and (
+        _GRAPH_TTL_S <= 0 or time.monotonic() - _built_at[name] <= _GRAPH_TTL_S
+    )
+
+
+async def _build_graph(name: str, port: int, status: str) -> AgentGraph:
+    """Сборка графа в отдельной задаче: отмена любого вызывающего её не прерывает."""
+    try:
+        with _span("zena.graph.build", persona=name, mcp_port=port, cache_status=status):
+            graph = await create_agent_graph(port)
+    except Exception:
+        # Отмена (остановка сервера) — не ошибка сборки и в счётчик не попадает.
+        _stats[name]["build_errors"] += 1
+        raise
+    else:
+        _registry[name] = graph
+        _built_at[name] = time.monotonic()
+        return graph
+    finally:
+        _inflight.pop(name, None)
+
+
+def _consume_exception(task: asyncio.Task[AgentGraph]) -> None:
+    # Если все ожидающие отменились, ошибку сборки никто не прочитает — читаем здесь.
+    if not task.cancelled():
+        task.exception()
+
+
+async def get_graph(name: str) -> AgentGraph:
+    """Возвращает скомпилированный граф компании, пересобирая его только по TTL."""
+    graph = _registry.get(name)
+    if graph is not None and _is_fresh(name):
+        _stats[name]["hits"] += 1
+        return graph
+
+    task = _inflight.get(name)
+    if task is not None:
+        _stats[name]["joined"] += 1
+    else:
+        port = MCP_PORTS.get(name)
+        if port is None:
+            raise RuntimeError(f"Неизвестный граф {name!r}; доступны: {_KNOWN_GRAPHS}")
+
+        # Граф от пула не зависит — пул открывается параллельно со сборкой, не перед ней.
+        _start_resources()
+
+        if graph is None:
+            _stats[name]["misses"] += 1
+            status = "miss"
+        else:
+            _stats[name]["expired"] += 1
+            status = "force_reload" if _FORCE_RELOAD else "expired"
+        logger.info(
+            "graph cache %s: %s — building",
+            status,
+            name,
+            extra={**_LOG_EXTRA[name], "cache_status": status},
+        )
+        task = asyncio.get_running_loop().create_task(_build_graph(name, port, status))
+        task.add_done_callback(_consume_exception)
+        _inflight[name] = task
+
+    # shield: отмена любого вызывающего (в том числе первого) не отменяет общую сборку
+    return await asyncio.shield(task)
+
+
+def _make_factory(name: str) -> Callable[[], Awaitable[AgentGraph]]:
+    """Асинхронная фабрика графа компании; все фабрики делят один код-объект."""
+    async def factory() -> AgentGraph:
+        # Счётчики кэша ведёт только get_graph — через него идут все вызовы.
+        return await get_graph(name)
+
+    factory.__name__ = factory.__qualname__ = f"make_graph_{name}"
+    return factory
+
+
+# Фабрики графов для langgraph.json: make_graph_<имя> для каждой компании из _PORT_SPECS.
+for _name in MCP_PORTS:
+    globals()[f"make_graph_{_name}"] = _make_factory(_name)
+del _name
+
+
+async def warmup_all() -> None:
+    """Собирает графы всех компаний параллельно (при старте сервера).
+
+    Ошибка сборки одного графа не мешает остальным: он соберётся при первом запросе.
+    """
+    names = tuple(MCP_PORTS)
+    results = await asyncio.gather(*(get_graph(name) for name in names), return_exceptions=True)
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            logger.error("warmup: граф %s не собран: %r", name, result, extra=_LOG_EXTRA[name])
+    logger.info("warmup: готово %d/%d графов", len(_registry), len(names))
@@ -85,6 +85,7 @@ def _build_drive_service(sa_file: str) -> Resource:
 
 @dataclass
 class _CacheEntry:
+    # fetched_at / checked_at — по time.monotonic(), не зависят от перевода часов
     text: str
     fetched_at: float
     checked_at: float
@@ -116,8 +117,8 @@ class GoogleDocTemplateReader:
     def _get_lock(self, key: str) -> asyncio.Lock:
         lock = self._LOCKS.get(key)
         if lock is None:
-            lock = asyncio.Lock()
-            self._LOCKS[key] = lock
+            # setdefault атомарен: все корутины гарантированно получат один и тот же Lock
+            lock = self._LOCKS.setdefault(key, asyncio.Lock())
         return lock
 
     @retry_async()
@@ -158,7 +159,7 @@ class GoogleDocTemplateReader:
     @retry_async()
     async def read_text(self) -> str:
         doc_id = extract_google_doc_id(self.doc_url)
-        now = time.time()
+        now = time.monotonic()
 
         async with self._get_lock(doc_id):
             entry = self._CACHE.get(doc_id)
@@ -1,15 +1,10 @@
 """Функции для работы с API httpservice.ai2b.pro."""
 
-import asyncio
-import random
-
 import aiohttp
-from typing_extensions import Any, Awaitable, Callable, Type, TypeVar
+from typing_extensions import Any
 
 # Свои модули
-from .zena_common import logger
-
-T = TypeVar("T")
+from .zena_common import logger, retry_async
 
 
 async def sent_message_to_history(
@@ -28,8 +23,7 @@ async def sent_message_to_history(
     dialog_state_new: str,
 ) -> dict[str, Any]:
     """Отправка переменных на endpoint для сохранения с повтором при ошибках."""
-    return await retry_async(
-        _sent_message_to_history,
+    return await _sent_message_to_history(
         user_id,
         text,
         user_companychat,
@@ -46,6 +40,7 @@ async def sent_message_to_history(
     )
 
 
+@retry_async(retries=1)
 async def _sent_message_to_history(
     user_id: int,
     text: str,
@@ -91,48 +86,11 @@ async def _sent_message_to_history(
                 resp.raise_for_status()
                 return await resp.json()
     except aiohttp.ClientResponseError as e:
-        logger.warning(f"HTTP error: {e.status} {e.message}")
+        logger.warning("HTTP error: %s %s", e.status, e.message)
         raise
     except (aiohttp.ConnectionTimeoutError, aiohttp.ServerTimeoutError):
         logger.warning("Request timed out")
         raise
     except aiohttp.ClientError as e:
-        logger.warning(f"Client error: {e}")
+        logger.warning("Client error: %s", e)
         raise
-
-
-async def retry_async(
-    func: Callable[..., Awaitable[T]],
-    *args: Any,
-    retries: int = 1,
-    backoff: float = 2.0,
-    jitter: float = 1.0,
-    exceptions: tuple[Type[BaseException], ...] = (Exception,),
-    **kwargs: Any,
-) -> T:
-    """Асинхронные ретраи с экспоненциальным бэкоффом и равномерным джиттером.
-
-    - func: async-функция, которую ретраим
-    - retries: общее число попыток
-    - backoff: базовый коэффициент экспоненты (например, 2.0 => 2^attempt)
-    - jitter: амплитуда добавочного шума [0, jitter)
-    - exceptions: кортеж типов исключений, которые нужно ретраить
-    """
-    for attempt in range(1, retries + 1):
-        try:
-            return await func(*args, **kwargs)
-        except exceptions as e:
-            if attempt == retries:
-                logger.exception(
-                    f"Последняя неудачная попытка {getattr(func, '__name__', func)}: {e}"
-                )
-                raise
-            wait = (backoff**attempt) + random.uniform(0, jitter)
-            logger.warning(
-                f"Ошибка в {getattr(func, '__name__', func)}: {e} | попытка {attempt}/{retries} — "
-                f"повтор через {wait:.1f}s"
-            )
-            # Неблокирующее ожидание — не мешает другим корутинам
-            await asyncio.sleep(wait)
-    # Этот raise теоретически невозможен, но для mypy необходим
-    raise RuntimeError("retry_async исчерпал все попытки повтора без возврата")
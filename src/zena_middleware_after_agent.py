@@ -5,7 +5,7 @@ from langchain.agents.middleware import AgentMiddleware
 
 from .zena_common import logger
 from .zena_state import State, Context, RESET
-from .zena_common import _content_to_text, _func_name
+from .zena_common import _content_to_text
 from .zena_httpservice import sent_message_to_history
 
 
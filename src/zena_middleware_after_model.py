@@ -7,7 +7,7 @@ from langchain_core.messages import AnyMessage, AIMessage, BaseMessage
 
 
 
-from .zena_common import logger, _func_name
+from .zena_common import logger
 from .zena_state import State, Context
 
 class GetCRMGOOnboardStage(AgentMiddleware):
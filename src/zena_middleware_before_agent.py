@@ -13,7 +13,14 @@ from langchain.agents.middleware import (
     hook_config,
 )
 from .zena_state import State, Context
-from .zena_common import logger, _content_to_text
+from .zena_common import (
+    PREDEFINED_DEL_PERSONAL_DATA,
+    PREDEFINED_MESSAGES,
+    PREDEFINED_STOP,
+    logger,
+    _content_to_text,
+    _is_keyword,
+)
 from .zena_postgres import (
     delete_history_messages,
     delete_personal_data,
@@ -24,23 +31,6 @@ from .zena_postgres import (
 )
 from .zena_requests import fetch_personal_info, fetch_crm_go_client_info
 
-# Список сообщений из httpservice на запрещенные темы.
-# которые передаем клиенту через бота.
-PREDEFINED_MESSAGES = [
-    "Ваше сообщение не может быть обработано 🚫",
-    "Пожалуйста, отправьте корректные данные 🙏",
-    "Мы не можем принять это сообщение ❌",
-    "Ай-ай-ай, ругаться плохо!",
-    "Давайте без таких слов 🙂",
-    "Попробуйте выразиться по-другому 😉",
-    "Нехорошо так говорить 😇",
-    "Давайте держать общение в позитивном ключе!",
-]
-
-# По этому кодовому слову чистится история диалога.
-PREDEFINED_STOP = "стоп"
-PREDEFINED_DEL_PERSONAL_DATA = "phone" 
-
 
 class VerifyInputMessage(AgentMiddleware):
     @hook_config(can_jump_to=["end"])
@@ -69,7 +59,7 @@ class VerifyInputMessage(AgentMiddleware):
             if studio:
                 await save_query_from_human_in_postgres(user_companychat, last_message)
 
-            if last_message.lower() == PREDEFINED_STOP:
+            if _is_keyword(last_message, PREDEFINED_STOP):
                 await delete_history_messages(user_companychat)
                 data = await data_user_info(user_companychat)
                 # responce_mem = await memory.delete_all(run_id='test')
@@ -80,7 +70,7 @@ class VerifyInputMessage(AgentMiddleware):
                     **data,
                     "jump_to": "end"
                 }
-            if last_message.lower() == PREDEFINED_DEL_PERSONAL_DATA:
+            if _is_keyword(last_message, PREDEFINED_DEL_PERSONAL_DATA):
                 await delete_personal_data(user_companychat)
                 data = await data_user_info(user_companychat)
                 # responce_mem = await memory.delete_all(run_id='test')
@@ -3,10 +3,11 @@ from __future__ import annotations
 from typing import Any, Callable
 
 
-import aiofiles
 import os
 import hashlib
+import logging
 
+from functools import lru_cache
 from pathlib import Path
 from typing import Callable
 from jinja2 import Template, Environment, StrictUndefined, DebugUndefined
@@ -25,8 +26,24 @@ from .zena_common import logger, model_4o, model_4o_mini, model_ai
 from .zena_state import State, Context
 from .zena_google_doc import GoogleDocTemplateReader
 
+# Строгий рендеринг: если переменной нет — лучше упасть здесь, чем получить пустой prompt
+# _JINJA = Environment(undefined=StrictUndefined)
+_JINJA = Environment(undefined=DebugUndefined)
+
+TEMPLATE_DIR = Path(__file__).parent / "template"
+TEMPLATE_SUFFIXES = (".md", ".j2", ".txt")
+
+
+@lru_cache(maxsize=32)
+def _compile_template(source: str) -> Template:
+    """Компилирует шаблон один раз на каждый уникальный текст."""
+    return _JINJA.from_string(source)
+
 
 class DynamicSystemPrompt(AgentMiddleware):
+    # Кеш исходников шаблонов из template/ (в prod файлы не меняются)
+    _TEMPLATE_SOURCES: dict[str, str] = {}
+
     async def awrap_model_call(
         self,
         request: ModelRequest,
@@ -44,11 +61,7 @@ class DynamicSystemPrompt(AgentMiddleware):
         is_dev = env_name == "dev"
 
         source = await self._load_template_source(request=request, data=data, is_dev=is_dev)
-
-        # Строгий рендеринг: если переменной нет — лучше упасть здесь, чем получить пустой prompt
-        # jinja = Environment(undefined=StrictUndefined)
-        jinja = Environment(undefined=DebugUndefined)
-        system_prompt = jinja.from_string(source).render(**data)
+        system_prompt = _compile_template(source).render(**data)
 
         # Сохраняем отрендеренный prompt (как у вас и задумано)
         data["prompt_system"] = system_prompt
@@ -84,12 +97,40 @@ class DynamicSystemPrompt(AgentMiddleware):
                 "or template_prompt_system_url/_prompt_google_url for Google Docs."
             )
 
-        tpl_path = Path(__file__).parent / "template" / tpl_name
+        # В dev читаем файл каждый раз, чтобы правки шаблона подхватывались без рестарта
+        if is_dev:
+            return self._read_template_file(tpl_name)
+
+        source = self._TEMPLATE_SOURCES.get(tpl_name)
+        if source is None:
+            source = self._read_template_file(tpl_name)
+            self._TEMPLATE_SOURCES[tpl_name] = source
+        return source
+
+    @classmethod
+    def preload_templates(cls) -> int:
+        """Читает и компилирует все шаблоны из template/ при старте.
+
+        Ошибки синтаксиса всплывают сразу, а первый запрос не платит за компиляцию.
+        Возвращает количество загруженных шаблонов.
+        """
+        count = 0
+        for tpl_path in sorted(TEMPLATE_DIR.iterdir()):
+            if not tpl_path.is_file() or tpl_path.suffix not in TEMPLATE_SUFFIXES:
+                continue
+            source = tpl_path.read_text(encoding="utf-8")
+            _compile_template(source)
+            cls._TEMPLATE_SOURCES[tpl_path.name] = source
+            count += 1
+        logger.info("preload_templates: %s templates", count)
+        return count
+
+    @staticmethod
+    def _read_template_file(tpl_name: str) -> str:
+        tpl_path = TEMPLATE_DIR / tpl_name
         if not tpl_path.exists():
             raise FileNotFoundError(f"Template file not found: {tpl_path}")
-
-        async with aiofiles.open(tpl_path, encoding="utf-8") as f:
-            return await f.read()
+        return tpl_path.read_text(encoding="utf-8")
 
     def _resolve_doc_url(self, request: ModelRequest, data: dict, is_dev: bool) -> str | None:
         doc_url = None
@@ -107,6 +148,10 @@ class DynamicSystemPrompt(AgentMiddleware):
 
 
     def _log_prompt(self, system_prompt: str, data: dict, is_dev: bool) -> None:
+        # sha256 по всему промпту — не считаем, если INFO всё равно отфильтрован
+        if not logger.isEnabledFor(logging.INFO):
+            return
+
         dialog_state = data.get("dialog_state")
         logger.info("dialog_state=%r", dialog_state)
 
@@ -187,6 +232,14 @@ class ToolSelectorMiddleware(AgentMiddleware):
     PORTS_4007_5007 = {15007, 5007}
     PORT_5020 = {15020, 5020}
 
+    # Профиль порта считается один раз при импорте: вместо цепочки проверок
+    # по множествам в каждом вызове — один поиск в словаре.
+    PORT_PROFILE: dict[int, str] = {
+        **dict.fromkeys(CLASSIC_PORTS, "classic"),
+        **dict.fromkeys(PORTS_4007_5007, "4007_5007"),
+        **dict.fromkeys(PORT_5020, "5020"),
+    }
+
     # =========================================================================
     # MAIN: select tools
     # =========================================================================
@@ -197,15 +250,18 @@ class ToolSelectorMiddleware(AgentMiddleware):
         mcp_port = data.get("mcp_port")
         dialog_state = (data.get("dialog_state") or "new").strip()
 
-        logger.info("dialog_state=%s", dialog_state)
-        logger.info("mcp_port=%s", mcp_port)
-        logger.info("all_tools=%s", [t.name for t in tools])
+        log_info = logger.isEnabledFor(logging.INFO)
+        if log_info:
+            logger.info("dialog_state=%s", dialog_state)
+            logger.info("mcp_port=%s", mcp_port)
+            logger.info("all_tools=%s", [t.name for t in tools])
 
         allowed = self._build_allowed_tools(mcp_port=mcp_port, dialog_state=dialog_state, data=data)
         filtered = [tool for tool in tools if tool.name in allowed]
 
-        logger.info("allowed_tools=%s", sorted(allowed))
-        logger.info("tools_filtered=%s", [t.name for t in filtered])
+        if log_info:
+            logger.info("allowed_tools=%s", sorted(allowed))
+            logger.info("tools_filtered=%s", [t.name for t in filtered])
         return filtered
 
     def _build_allowed_tools(self, *, mcp_port: int | None, dialog_state: str, data: dict) -> set[str]:
@@ -213,25 +269,22 @@ class ToolSelectorMiddleware(AgentMiddleware):
         
         base = set(self.GLOBAL_TOOLS)
 
-        if mcp_port is None:
+        profile = self._port_profile(mcp_port)
+        if profile is None:
             return self._apply_guards(dialog_state, base, data)
 
-        if mcp_port in self.PORT_5020:
-            allowed = self._allowed_for_5020(dialog_state, data, base)
-            return self._apply_guards(dialog_state, allowed, data)
-
-        if mcp_port in self.PORTS_4007_5007:
-            allowed = self._allowed_for_4007_5007(dialog_state, data, base)
+        allowed = self.PROFILE_BUILDERS[profile](self, dialog_state, data, base)
+        if profile != "classic":
             return self._apply_guards(dialog_state, allowed, data)
 
-        if mcp_port in self.CLASSIC_PORTS:
-            allowed = self._allowed_for_classic_ports(dialog_state, data, base)
-            logger.info(f"allowed: {allowed}")
-            responce = self._apply_guards(dialog_state, allowed, data)
-            logger.info(f"responce _apply_guards: {responce}")
-            return responce
+        logger.info("allowed: %s", allowed)
+        responce = self._apply_guards(dialog_state, allowed, data)
+        logger.info("responce _apply_guards: %s", responce)
+        return responce
 
-        return self._apply_guards(dialog_state, base, data)
+    @classmethod
+    def _port_profile(cls, mcp_port: int | None) -> str | None:
+        return cls.PORT_PROFILE.get(mcp_port) if mcp_port is not None else None
 
     # =========================================================================
     # Classic ports logic
@@ -337,7 +390,7 @@ class ToolSelectorMiddleware(AgentMiddleware):
         office_id = str(data.get("office_id") or "").strip()
         desired_date = str(data.get("desired_date") or "").strip()
         responce = bool(office_id and desired_date)
-        logger.info(f"responce: {responce}")
+        logger.info("responce: %s", responce)
         return responce
 
     @staticmethod
@@ -403,6 +456,16 @@ class ToolSelectorMiddleware(AgentMiddleware):
 
         return allowed
 
+    # Профиль -> построитель набора инструментов. Ссылки на сами функции (после их
+    # определения), а не имена атрибутов: так вызовы видны проверке типов.
+    PROFILE_BUILDERS: dict[
+        str, Callable[[ToolSelectorMiddleware, str, dict[str, Any], set[str]], set[str]]
+    ] = {
+        "classic": _allowed_for_classic_ports,
+        "4007_5007": _allowed_for_4007_5007,
+        "5020": _allowed_for_5020,
+    }
+
     # =========================================================================
     # Model selection
     # =========================================================================
@@ -411,13 +474,12 @@ class ToolSelectorMiddleware(AgentMiddleware):
         mcp_port = data.get("mcp_port")
         dialog_state = (data.get("dialog_state") or "new").strip()
 
-        if mcp_port in self.PORTS_4007_5007:
-            return model_4o if dialog_state in ("new", "available_time") else model_ai
+        profile = self._port_profile(mcp_port)
 
-        if mcp_port in self.PORT_5020:
-            return model_ai
+        if profile == "4007_5007":
+            return model_4o if dialog_state in ("new", "available_time") else model_ai
 
-        if mcp_port in self.CLASSIC_PORTS:
+        if profile == "classic":
             return model_4o if dialog_state in ("postrecord") else model_ai # "new", "remember"
 
         return model_ai
@@ -443,10 +505,7 @@ async def personalized_prompt(request: ModelRequest) -> str:
     # logger.info(f'state: {request.state["data"]}')
     tpl_system_prompt = request.state["data"]["template_prompt_system"]
     # tpl_system_prompt = 'prompt_agent_of_service_selection_v1.md'
-    tpl_path = Path(__file__).parent / "template" / tpl_system_prompt
-
-    async with aiofiles.open(tpl_path, encoding="utf-8") as f:
-        source = await f.read()
+    source = (TEMPLATE_DIR / tpl_system_prompt).read_text(encoding="utf-8")
     data = request.state.get("data", {})
     # data['item_selected'] = request.state.get("item_selected", [])
     # logger.info(f'\nstate: {request.state}')
@@ -8,6 +8,7 @@ from __future__ import annotations
 
 import json
 from dataclasses import dataclass
+from types import ModuleType
 from typing import Any, Awaitable, Callable, Optional, Type
 
 from langgraph.types import Command
@@ -17,6 +18,15 @@ from langchain.agents.middleware import AgentMiddleware
 
 from .zena_common import logger, _content_to_text
 
+# orjson приходит транзитивно (langsmith); без него — стандартный json.
+orjson: ModuleType | None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
 AVAILIABLE_PORT_ALENA = {15020, 5020}
 AVAILIABLE_PORT_DEFAULT = {15001, 5001, 5002, 15002, 15005, 5005, 15006, 5006, 15021, 5021, 15024, 5024, 15017, 5017}
 
@@ -54,8 +64,8 @@ def _parse_tool_content(result: ToolMessage) -> Any:
     if not raw_content or not raw_content.strip():
         return ""  # иногда tool возвращает пустое
     try:
-        return json.loads(raw_content)
-    except (json.JSONDecodeError, TypeError):
+        return _json_loads(raw_content)
+    except (ValueError, TypeError):
         return raw_content
 
 
@@ -588,12 +598,19 @@ TOOL_POSTPROCESSORS_ALENA: dict[str, PostProcessor] = {
 }
 
 
+# Реестр постпроцессоров по порту собирается один раз при импорте.
+_PORT_TO_POSTPROCESSORS: dict[int, dict[str, PostProcessor]] = {
+    **dict.fromkeys(AVAILIABLE_PORT_ALENA, TOOL_POSTPROCESSORS_ALENA),
+    5007: TOOL_POSTPROCESSORS_5007,
+}
+
+
 def _get_registry_for_request(request: ToolCallRequest) -> dict[str, PostProcessor]:
     data = request.state.get("data") or {}
-    port = data.get("mcp_port")
-    if port in AVAILIABLE_PORT_ALENA:
-        return TOOL_POSTPROCESSORS_ALENA
-    return TOOL_POSTPROCESSORS_DEFAULT
+    mcp_port = data.get("mcp_port")
+    if mcp_port is None:
+        return TOOL_POSTPROCESSORS_DEFAULT
+    return _PORT_TO_POSTPROCESSORS.get(mcp_port, TOOL_POSTPROCESSORS_DEFAULT)
 
 
 class ToolMonitoringMiddleware(AgentMiddleware):
@@ -626,12 +643,6 @@ class ToolMonitoringMiddleware(AgentMiddleware):
             )
 
             registry = _get_registry_for_request(request)
-
-            # если реально есть особый реестр под 5007 — оставляем
-            data_state = request.state.get("data") or {}
-            if data_state.get("mcp_port") == 5007:
-                registry = TOOL_POSTPROCESSORS_5007
-
             pp = registry.get(tool_name)
             pp_result = await pp(env, request) if pp else None
 
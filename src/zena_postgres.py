@@ -1,22 +1,20 @@
 """Модуль реализует функции обращения к Postgres."""
 
+import asyncio
 import json
 import os
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 import asyncpg
-from dotenv import load_dotenv
-from pathlib import Path
-from typing_extensions import Any, Dict, List, Iterable
+from typing_extensions import Any, AsyncIterator, Awaitable, Callable, Dict, List, Iterable, TypeVar
 
-from .zena_common import logger, retry_async
+from .zena_common import load_env, logger, retry_async
 from .zena_requests import fetch_personal_info, fetch_personal_records
 from .zena_request_masters_cache import fetch_masters_info
 
-if not os.getenv("IS_DOCKER"):
-    ROOT = Path(__file__).resolve().parents[3]
-    dotenv_path = ROOT / "deploy" / "dev.env"
-    load_dotenv(dotenv_path=dotenv_path)
+load_env()
 
 
 POSTGRES_CONFIG = {
@@ -27,6 +25,104 @@ POSTGRES_CONFIG = {
     "port": os.getenv("POSTGRES_PORT"),
 }
 
+T = TypeVar("T")
+
+# -------------------- Pool --------------------
+# Пул вместо connect/close на каждый запрос: соединения и кеш подготовленных
+# выражений asyncpg переживают отдельный вызов.
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", "1"))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "10"))
+
+_pool: asyncpg.Pool | None = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool() -> asyncpg.Pool:
+    """Возвращает общий пул соединений, создавая его при первом вызове."""
+    global _pool
+    if _pool is not None:
+        return _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                **POSTGRES_CONFIG,
+                min_size=POSTGRES_POOL_MIN,
+                max_size=POSTGRES_POOL_MAX,
+            )
+    return _pool
+
+
+async def close_pool() -> None:
+    """Закрывает пул (при остановке сервера)."""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+@asynccontextmanager
+async def _connection() -> AsyncIterator[asyncpg.Connection]:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        yield conn
+
+
+# -------------------- TTL cache --------------------
+# Настройки компании (канал, промпты, категории, услуги) меняются редко —
+# держим их в памяти процесса. Данные диалога и клиента не кешируются.
+PG_CACHE_TTL_SEC = float(os.getenv("PG_CACHE_TTL_SEC", "60"))
+PG_CACHE_MAX_SIZE = 10_000
+
+# key -> (время записи по time.monotonic(), значение)
+_CACHE: dict[tuple[Any, ...], tuple[float, Any]] = {}
+# Замки живут, пока у ключа есть хотя бы один вызов (держатель или ожидающий):
+# счётчик в _CACHE_WAITERS, последний уходящий удаляет замок.
+_CACHE_LOCKS: dict[tuple[Any, ...], asyncio.Lock] = {}
+_CACHE_WAITERS: dict[tuple[Any, ...], int] = {}
+
+
+async def _cached(key: tuple[Any, ...], loader: Callable[[], Awaitable[T]]) -> T:
+    """Значение из кеша или loader() под per-key lock (без thundering herd)."""
+    hit = _CACHE.get(key)
+    if hit is not None and time.monotonic() - hit[0] < PG_CACHE_TTL_SEC:
+        return hit[1]
+
+    lock = _CACHE_LOCKS.get(key)
+    if lock is None:
+        lock = _CACHE_LOCKS[key] = asyncio.Lock()
+    _CACHE_WAITERS[key] = _CACHE_WAITERS.get(key, 0) + 1
+
+    try:
+        async with lock:
+            hit = _CACHE.get(key)
+            now = time.monotonic()
+            if hit is not None and now - hit[0] < PG_CACHE_TTL_SEC:
+                return hit[1]
+
+            value = await loader()
+            if value:
+                if len(_CACHE) >= PG_CACHE_MAX_SIZE:
+                    _evict_expired(now)
+                _CACHE[key] = (time.monotonic(), value)
+            return value
+    finally:
+        # Пока кто-то ждёт, замок остаётся: иначе при ошибке или пустом результате
+        # следующий вызов создал бы новый замок и пошёл в БД параллельно с очередью.
+        left = _CACHE_WAITERS[key] - 1
+        if left:
+            _CACHE_WAITERS[key] = left
+        else:
+            del _CACHE_WAITERS[key]
+            del _CACHE_LOCKS[key]
+
+
+def _evict_expired(now: float) -> None:
+    expired = [k for k, (ts, _) in _CACHE.items() if now - ts >= PG_CACHE_TTL_SEC]
+    for k in expired:
+        del _CACHE[k]
+    if len(_CACHE) >= PG_CACHE_MAX_SIZE:
+        _CACHE.clear()
+
 async def get_weekday_info(dt: datetime | None = None) -> tuple[int, str]:
     """Асинхронно возвращает номер и название дня недели."""
     if dt is None:
@@ -58,46 +154,64 @@ def flatten_dict_no_prefix(d: dict[str, Any]) -> dict[str, Any]:
 
 async def data_collection_postgres(user_companychat: int) -> dict[str, Any]:
     """Функция получения всех данных из Postgres."""
-    conn = await asyncpg.connect(**POSTGRES_CONFIG)
-    try:
-        # 1) Канальный контекст
-        channel_info = await fetch_channel_info(conn, user_companychat)
-        channel_id = channel_info["channel_id"]
-        session_id = channel_info["session_id"]
-        user_id = channel_info["user_id"]
-
-        # 2) Последовательный сбор данных
-        prompts_info = await fetch_prompts(conn, user_companychat)
-        category = await fetch_category(conn, channel_id)
-        products_full = await fetch_services(conn, channel_id)
-        probny = await fetch_probny(conn, channel_id)
+    # Соединение из пула держим только на время SQL: HTTP-запросы ниже
+    # (с таймаутами и ретраями) не должны занимать его у других запросов.
+    # Кешируемые загрузчики берут соединение сами, уже после проверки кеша,
+    # поэтому ожидающие на замке ключа соединений из пула не держат.
+
+    # 1) Канальный контекст (кешируется вместе с промптами)
+    async def load_channel() -> tuple[Dict[str, Any], Dict[str, Any]] | None:
+        async with _connection() as conn:
+            info = await fetch_channel_info(conn, user_companychat)
+            if not info:
+                return None
+            return info, await fetch_prompts(conn, user_companychat)
+
+    channel = await _cached(("channel", user_companychat), load_channel)
+    channel_info, prompts_info = channel or ({}, {})
+    channel_id = channel_info["channel_id"]
+    session_id = channel_info["session_id"]
+    user_id = channel_info["user_id"]
+
+    # 2) Каталог компании — общий для всех диалогов канала
+    async def load_catalog() -> tuple[str, Any, str]:
+        async with _connection() as conn:
+            return (
+                await fetch_category(conn, channel_id),
+                await fetch_services(conn, channel_id),
+                await fetch_probny(conn, channel_id),
+            )
+
+    category, products_full, probny = await _cached(("catalog", channel_id), load_catalog)
+
+    # 3) Данные диалога — всегда свежие
+    async with _connection() as conn:
         first_dialog = await fetch_is_first_dialog(conn, user_companychat)
-        masters_info = await fetch_masters_info(channel_id)
-        user_info = await fetch_personal_info(user_id)
-
-        now = datetime.now()
-        weekday_num, weekday_name = await get_weekday_info(now)
-
-        data = {
-            "user_id": user_id,
-            "date_time": now.strftime("%Y-%m-%d %H:%M:%S"),
-            "weekday_num": weekday_num,
-            "weekday_name": weekday_name,
-            **channel_info,
-            "prompts_info": prompts_info,
-            "category": category,
-            "products_full": products_full,
-            "probny": probny,
-            "first_dialog": first_dialog,
-            "user_info": user_info,
-            "masters_info": masters_info,
-        }
-
-        flat_data = flatten_dict_no_prefix(data)
-        return {"data": flat_data}
 
-    finally:
-        await conn.close()
+    # 4) Данные из внешних сервисов — уже без соединения с БД
+    masters_info = await fetch_masters_info(channel_id)
+    user_info = await fetch_personal_info(user_id)
+
+    now = datetime.now()
+    weekday_num, weekday_name = await get_weekday_info(now)
+
+    data = {
+        "user_id": user_id,
+        "date_time": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "weekday_num": weekday_num,
+        "weekday_name": weekday_name,
+        **channel_info,
+        "prompts_info": prompts_info,
+        "category": category,
+        "products_full": products_full,
+        "probny": probny,
+        "first_dialog": first_dialog,
+        "user_info": user_info,
+        "masters_info": masters_info,
+    }
+
+    flat_data = flatten_dict_no_prefix(data)
+    return {"data": flat_data}
 
 
 
@@ -144,23 +258,22 @@ async def data_collection_postgres(user_companychat: int) -> dict[str, Any]:
 
 async def data_user_info(user_companychat: int) -> dict[str, Any]:
     """Функция получения данных о пользователе и компании из Postgres."""
-    conn = await asyncpg.connect(**POSTGRES_CONFIG)
-    try:
+    async with _connection() as conn:
         # 1) Канальный контекст
         channel_info = await fetch_channel_info(conn, user_companychat)
-        user_id = channel_info["user_id"]
-        user_info = await fetch_personal_info(user_id)
-
-        data = {
-            "user_id": user_id,
-            "date_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            **channel_info,
-            "user_info": user_info,
-        }
-        flat_data = flatten_dict_no_prefix(data)
-        return {"data": flat_data}
-    finally:
-        await conn.close()
+
+    # 2) Данные клиента из внешнего сервиса — соединение с БД уже возвращено в пул
+    user_id = channel_info["user_id"]
+    user_info = await fetch_personal_info(user_id)
+
+    data = {
+        "user_id": user_id,
+        "date_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        **channel_info,
+        "user_info": user_info,
+    }
+    flat_data = flatten_dict_no_prefix(data)
+    return {"data": flat_data}
 
 
 @retry_async()
@@ -218,8 +331,7 @@ def pg_rows_to_products(rows: Iterable[asyncpg.Record]) -> list[dict[str, Any]]:
 @retry_async()
 async def fetch_key_words(channel_id: int, key_word: str) -> Any:
     """Получение ключевых фраз"""
-    conn = await asyncpg.connect(**POSTGRES_CONFIG)
-    try:
+    async with _connection() as conn:
         rows = await conn.fetch(
             """
             select distinct on (p2.product_name)
@@ -245,8 +357,6 @@ async def fetch_key_words(channel_id: int, key_word: str) -> Any:
             return []
 
         return pg_rows_to_products(rows)
-    finally:
-        await conn.close()
 
 
 @retry_async()
@@ -429,8 +539,7 @@ async def fetch_probny(conn: asyncpg.Connection, channel_id: int) -> str:
 @retry_async()
 async def delete_history_messages(user_companychat: int) -> Dict[str, Any]:
     """Удаление истории диалога. Используется для тестирования."""
-    conn = await asyncpg.connect(**POSTGRES_CONFIG)
-    try:
+    async with _connection() as conn:
         channel_info = await fetch_channel_info(conn, user_companychat)
         session_id = channel_info.get("session_id")
         if not session_id:
@@ -454,16 +563,13 @@ async def delete_history_messages(user_companychat: int) -> Dict[str, Any]:
             success = False
 
         return {"success": success}
-    finally:
-        await conn.close()
 
 
 @retry_async()
 async def delete_personal_data(user_companychat: int) -> Dict[str, Any]:
     """Удаление истории диалога. Используется для тестирования."""
     logger.info("===delete_personal_data===")
-    conn = await asyncpg.connect(**POSTGRES_CONFIG)
-    try:
+    async with _connection() as conn:
         channel_info = await fetch_channel_info(conn, user_companychat)
         logger.info(f"channel_info: {channel_info}")
         success = False
@@ -496,34 +602,30 @@ async def delete_personal_data(user_companychat: int) -> Dict[str, Any]:
             success = False
 
         return {"success": success}
-    finally:
-        await conn.close()
 
 
 
 @retry_async()
 async def save_query_from_human_in_postgres(user_companychat: int, query: str) -> bool:
     """Сохранение запроса клиента в Postgres. Необходимо при тестировании в Studio."""
-    conn = await asyncpg.connect(**POSTGRES_CONFIG)
     try:
-        await conn.execute(
-            """
-            INSERT INTO bot_history 
-            (user_companychat, is_bot, for_user, dialog_state_id, created_at, indata)
-            VALUES 
-            ($1, $2, $3, $4, $5, $6)
-            """,
-            user_companychat,  # $1
-            0,                 # $2
-            False,             # $3
-            1,                 # $4
-            datetime.now(),    # $5
-            query              # $6
-        )
+        async with _connection() as conn:
+            await conn.execute(
+                """
+                INSERT INTO bot_history 
+                (user_companychat, is_bot, for_user, dialog_state_id, created_at, indata)
+                VALUES 
+                ($1, $2, $3, $4, $5, $6)
+                """,
+                user_companychat,  # $1
+                0,                 # $2
+                False,             # $3
+                1,                 # $4
+                datetime.now(),    # $5
+                query              # $6
+            )
         success = True
     except Exception as e:
         logger.error(f"Error saving query to bot_history: {e}")
         success = False
-    finally:
-        await conn.close()
-        return success
\ No newline at end of file
+    return success
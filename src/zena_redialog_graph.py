@@ -2,8 +2,11 @@
 
 from langgraph.graph import END, START, StateGraph
 
+from .zena_common import setup_logging
 from .zena_redialog_agent import agent_redialog, AgentState
 
+setup_logging()
+
 graph_agent_redialog = StateGraph(
     state_schema=AgentState,
 )
@@ -63,7 +63,7 @@ MEM_VALUE_TTL_SECONDS = 24 * 60 * 60  # сутки
 # =========================
 # In-memory fallback cache
 # =========================
-# Храним: key -> (expires_at, value_json_str)
+# Храним: key -> (expires_at по time.monotonic(), value_json_str)
 _mem_kv: dict[str, tuple[float, str]] = {}
 _mem_lock = asyncio.Lock()
 
@@ -73,14 +73,14 @@ def _mem_get(key: str) -> str | None:
     if not item:
         return None
     exp, val = item
-    if exp < time.time():
+    if exp < time.monotonic():
         _mem_kv.pop(key, None)
         return None
     return val
 
 
 def _mem_set(key: str, value: str, ttl_seconds: int) -> None:
-    _mem_kv[key] = (time.time() + ttl_seconds, value)
+    _mem_kv[key] = (time.monotonic() + ttl_seconds, value)
 
 
 async def _try_acquire_mem_lock() -> bool:
@@ -131,31 +131,46 @@ def resolve_redis_url() -> str:
 # Redis client (safe)
 # =========================
 _redis: redis.Redis | None = None
+# Общая задача подключения: параллельные первые вызовы ждут одно подключение.
+_redis_init: asyncio.Task[redis.Redis | None] | None = None
 
 
-async def get_redis_safe() -> redis.Redis | None:
-    """
-    Возвращает Redis клиент или None, если Redis недоступен.
-    Кеш не должен валить основную логику.
-    """
-    global _redis
-    if _redis is not None:
-        return _redis
-
+async def _connect_redis() -> redis.Redis | None:
     redis_url = resolve_redis_url()
     logger.info("Using Redis URL: %s", redis_url)
 
     try:
         client = redis.from_url(redis_url, encoding="utf-8", decode_responses=True)
         await client.ping()
-        _redis = client
         logger.info("Redis connected")
-        return _redis
+        return client
     except Exception as e:
         logger.warning("Redis unavailable (%s) -> using in-memory cache", e)
         return None
 
 
+async def get_redis_safe() -> redis.Redis | None:
+    """
+    Возвращает Redis клиент или None, если Redis недоступен.
+    Кеш не должен валить основную логику.
+    """
+    global _redis, _redis_init
+    if _redis is not None:
+        return _redis
+
+    if _redis_init is None:
+        _redis_init = asyncio.create_task(_connect_redis())
+    task = _redis_init
+
+    client = await asyncio.shield(task)
+    if client is not None:
+        _redis = client
+    elif _redis_init is task:
+        # Redis недоступен — следующий вызов попробует подключиться заново.
+        _redis_init = None
+    return client
+
+
 # =========================
 # Keys
 # =========================
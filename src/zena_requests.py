@@ -7,7 +7,7 @@ import httpx
 from typing import Any
 from datetime import datetime
 
-from .zena_common import logger, retry_async
+from .zena_common import logger, retry_async, setup_logging
 
 
 TIMEOUT_SECONDS = 120.0
@@ -273,6 +273,7 @@ async def main():
 
 
 if __name__ == "__main__":
+    setup_logging()
     asyncio.run(main())
 
 
@@ -1,11 +1,9 @@
 """Модуль описывающий состояние графа."""
 
-from __future__ import annotations
-
 from operator import add
 
 from langchain_core.messages import AnyMessage
-from langgraph.graph import add_messages
+from langgraph.graph import StateGraph, add_messages
 
 from typing import Any
 from typing_extensions import TypedDict, NotRequired, Required, Generic, TypeVar, Annotated
@@ -67,3 +65,13 @@ class PrivateState(TypedDict, total=False):
 class State(InputState, OutputState, PrivateState, total=False):  # type: ignore[misc]
     """Состояние графа."""
     pass
+
+
+def new_workflow() -> StateGraph[State, Context, InputState, OutputState]:
+    """Пустой StateGraph со схемами State/InputState/OutputState/Context."""
+    return StateGraph(
+        state_schema=State,
+        input_schema=InputState,
+        output_schema=OutputState,
+        context_schema=Context,
+    )
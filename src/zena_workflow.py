@@ -0,0 +1,51 @@
+"""Граф агента на нодах из zena_agent_node (legacy-сборка для zena_agent)."""
+
+from functools import cache
+
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.state import CompiledStateGraph
+
+from .zena_agent_node import (
+    agent,
+    count_tokens,
+    data_collection,
+    get_agent_model,
+    prepare_agent_context,
+    should_continue,
+    tools_node,
+    verification_message,
+)
+from .zena_state import Context, InputState, OutputState, State, new_workflow
+
+
+def build_workflow() -> StateGraph[State, Context, InputState, OutputState]:
+    """Граф агента на нодах из zena_agent_node (без компиляции)."""
+    # Fail-fast: без настроек модели граф не собираем, а не падаем на первом запросе.
+    get_agent_model()
+
+    workflow = new_workflow()
+
+    workflow.add_node("verification_message", verification_message)
+    workflow.add_node("data_collection", data_collection)
+    workflow.add_node("prepare_agent_context", prepare_agent_context)
+    workflow.add_node("agent", agent)
+    workflow.add_node("tools", tools_node)
+    workflow.add_node("count_tokens", count_tokens)
+
+    # Связи между узлами
+    workflow.add_edge(START, "verification_message")
+    workflow.add_edge("data_collection", "prepare_agent_context")
+    workflow.add_edge("prepare_agent_context", "agent")
+    workflow.add_conditional_edges(
+        "agent", should_continue, {"tools": "tools", "end": "count_tokens"}
+    )
+    workflow.add_edge("tools", "agent")
+    workflow.add_edge("count_tokens", END)
+
+    return workflow
+
+
+@cache
+def build_graph() -> CompiledStateGraph[State, Context, InputState, OutputState]:
+    """Скомпилированный граф агента (один экземпляр на процесс)."""
+    return build_workflow().compile()
@@ -0,0 +1,152 @@
+"""Загрузка инструментов MCP: circuit breaker и single-flight в _get_tools_safe."""
+
+import asyncio
+import time
+
+import pytest
+
+from src import zena_create_agent as agent_mod
+
+pytestmark = pytest.mark.asyncio
+
+PORT = 5999
+
+
+class FakeFetch:
+    """Подменяет _fetch_tools: считает вызовы, может ждать события или падать."""
+
+    def __init__(self, result=None, error=None, gate=None):
+        self.calls = 0
+        self.result = result if result is not None else ["tool"]
+        self.error = error
+        self.gate = gate
+        self.started = asyncio.Event()
+
+    async def __call__(self, mcp_port):
+        self.calls += 1
+        self.started.set()
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    # Модульные кэши общие на процесс — каждому тесту свои.
+    monkeypatch.setattr(agent_mod, "_TOOLS_CACHE", {})
+    monkeypatch.setattr(agent_mod, "_INFLIGHT", {})
+    monkeypatch.setattr(agent_mod, "_BREAKERS", {})
+    monkeypatch.setattr(agent_mod, "MCP_BREAKER_FAIL_MAX", 3)
+    monkeypatch.setattr(agent_mod, "MCP_BREAKER_COOLDOWN_S", 30.0)
+
+
+def open_breaker_with_expired_cooldown():
+    opened_at = time.monotonic() - agent_mod.MCP_BREAKER_COOLDOWN_S - 1
+    breaker = agent_mod._Breaker(state="open", fails=agent_mod.MCP_BREAKER_FAIL_MAX, opened_at=opened_at)
+    agent_mod._BREAKERS[PORT] = breaker
+    return breaker
+
+
+async def test_breaker_opens_after_fail_max(monkeypatch):
+    fetch = FakeFetch(error=ConnectionError("down"))
+    monkeypatch.setattr(agent_mod, "_fetch_tools", fetch)
+
+    for _ in range(agent_mod.MCP_BREAKER_FAIL_MAX):
+        with pytest.raises(ConnectionError):
+            await agent_mod._get_tools_safe(PORT)
+
+    breaker = agent_mod._BREAKERS[PORT]
+    assert breaker.state == "open"
+    assert breaker.fails == agent_mod.MCP_BREAKER_FAIL_MAX
+
+    # Пока окно не истекло, к серверу не ходим.
+    with pytest.raises(RuntimeError):
+        await agent_mod._get_tools_safe(PORT)
+    assert fetch.calls == agent_mod.MCP_BREAKER_FAIL_MAX
+
+
+async def test_breaker_stays_closed_below_fail_max(monkeypatch):
+    monkeypatch.setattr(agent_mod, "_fetch_tools", FakeFetch(error=ConnectionError("down")))
+
+    for _ in range(agent_mod.MCP_BREAKER_FAIL_MAX - 1):
+        with pytest.raises(ConnectionError):
+            await agent_mod._get_tools_safe(PORT)
+
+    assert agent_mod._BREAKERS[PORT].state == "closed"
+
+
+async def test_half_open_lets_exactly_one_probe_through(monkeypatch):
+    gate = asyncio.Event()
+    fetch = FakeFetch(gate=gate)
+    monkeypatch.setattr(agent_mod, "_fetch_tools", fetch)
+    breaker = open_breaker_with_expired_cooldown()
+
+    callers = [asyncio.create_task(agent_mod._get_tools_safe(PORT)) for _ in range(5)]
+    await fetch.started.wait()
+    assert breaker.state == "half_open"
+    assert fetch.calls == 1
+
+    gate.set()
+    results = await asyncio.gather(*callers)
+
+    assert fetch.calls == 1
+    assert all(result is fetch.result for result in results)
+    assert breaker.state == "closed"
+    assert breaker.fails == 0
+
+
+async def test_failed_probe_reopens_breaker(monkeypatch):
+    fetch = FakeFetch(error=ConnectionError("still down"))
+    monkeypatch.setattr(agent_mod, "_fetch_tools", fetch)
+    breaker = open_breaker_with_expired_cooldown()
+
+    with pytest.raises(ConnectionError):
+        await agent_mod._get_tools_safe(PORT)
+    assert breaker.state == "open"
+
+    with pytest.raises(RuntimeError):
+        await agent_mod._get_tools_safe(PORT)
+    assert fetch.calls == 1
+
+
+async def test_concurrent_callers_share_one_fetch(monkeypatch):
+    gate = asyncio.Event()
+    fetch = FakeFetch(gate=gate)
+    monkeypatch.setattr(agent_mod, "_fetch_tools", fetch)
+
+    callers = [asyncio.create_task(agent_mod._get_tools_safe(PORT)) for _ in range(10)]
+    await fetch.started.wait()
+    gate.set()
+    results = await asyncio.gather(*callers)
+
+    assert fetch.calls == 1
+    assert all(result is fetch.result for result in results)
+    assert PORT not in agent_mod._INFLIGHT
+    # Следующий вызов берёт инструменты из кэша.
+    assert await agent_mod._get_tools_safe(PORT) is fetch.result
+    assert fetch.calls == 1
+
+
+async def test_cancelled_first_caller_does_not_cancel_shared_load(monkeypatch):
+    gate = asyncio.Event()
+    fetch = FakeFetch(gate=gate)
+    monkeypatch.setattr(agent_mod, "_fetch_tools", fetch)
+
+    first = asyncio.create_task(agent_mod._get_tools_safe(PORT))
+    second = asyncio.create_task(agent_mod._get_tools_safe(PORT))
+    await fetch.started.wait()
+
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+    gate.set()
+    assert await second is fetch.result
+    assert fetch.calls == 1
+
+    breaker = agent_mod._BREAKERS[PORT]
+    assert breaker.state == "closed"
+    assert breaker.fails == 0
+    assert agent_mod._TOOLS_CACHE[PORT][1] is fetch.result